@@ -1,13 +1,31 @@
 import sqlite3
 import os
 import re
+import queue
+import threading
+import time
+import atexit
+import codecs
+import zlib
+import io
+import hashlib
+import json
+import math
+import multiprocessing
+import random
+import tracemalloc
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date, timedelta, datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g, Response
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, g, Response, has_app_context,
+                   make_response, get_template_attribute, jsonify)
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 import csv
-from io import StringIO
 from urllib.parse import quote
+import click
+import numpy as np
 
 
 SECRET_KEY_FILE = 'secret.key'
@@ -15,30 +33,414 @@ if not os.path.exists(SECRET_KEY_FILE):
     key = Fernet.generate_key()
     with open(SECRET_KEY_FILE, 'wb') as f:
         f.write(key)
-else:
+
+
+def read_card_keys():
     with open(SECRET_KEY_FILE, 'rb') as f:
-        key = f.read()
+        return [line.strip() for line in f.read().splitlines() if line.strip()]
+
+
+def write_card_keys(keys):
+    tmp_path = SECRET_KEY_FILE + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\n'.join(keys) + b'\n')
+    os.replace(tmp_path, SECRET_KEY_FILE)
 
-fernet = Fernet(key)
+
+_fernet = {'mtime': None, 'fernet': None}
+
+
+def get_fernet():
+    mtime = os.stat(SECRET_KEY_FILE).st_mtime_ns
+    if _fernet['mtime'] != mtime:
+        _fernet['fernet'] = MultiFernet([Fernet(k) for k in read_card_keys()])
+        _fernet['mtime'] = mtime
+    return _fernet['fernet']
 
 app = Flask(__name__)
 app.secret_key = 'school_canteen_secret_key_2026'
 DATABASE = 'database.db'
+DB_POOL_SIZE = 8
+DB_READ_POOL_SIZE = 4
+DB_POOL_TIMEOUT = 10
+DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),
+    ('mmap_size', 128 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+CATALOG_CHECK_INTERVAL = 5
+UNREAD_CACHE_TTL = 2
+ROLE_CACHE_TTL = 60
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_POLL_INTERVAL = 1
+OUTBOX_FLUSH_TIMEOUT = 5
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 1
+OUTBOX_RETRY_DELAY_MAX = 30
+REPORT_CHUNK_SIZE = 1000
+IMPORT_BATCH_SIZE = 500
+IMPORT_HASH_WORKERS = os.cpu_count() or 1
+IMPORT_POOL_THRESHOLD = 50
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+LOGIN_WORKERS = os.cpu_count() or 1
+LOGIN_QUEUE_LIMIT = 256
+ROTATION_CHUNK_SIZE = 500
+ROTATION_WORKERS = os.cpu_count() or 1
+PLANNER_DEFAULT_DAYS = 14
+PLANNER_MAX_DAYS = 180
+PLANNER_ATTENDANCE_DAYS = 28
+UNIT_SCALES = {
+    'г': ('г', 1), 'кг': ('г', 1000),
+    'мл': ('мл', 1), 'л': ('мл', 1000), 'литр': ('мл', 1000), 'литра': ('мл', 1000), 'литров': ('мл', 1000),
+}
+PROFILING = os.environ.get('CANTEEN_PROFILING') == '1'
+PROFILE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_REQUEST_SECONDS = float(os.environ.get('CANTEEN_SLOW_REQUEST_MS', 500)) / 1000
+QUERY_CHECK = os.environ.get('CANTEEN_QUERY_CHECK', '')
+QUERY_CHECK_REPEAT_LIMIT = 5
+QUERY_CHECK_SCAN_ROWS = 1000
+STATIC_MAX_AGE = 365 * 24 * 3600
+API_MENU_MAX_DAYS = 14
+API_STARTUP_MENU_DAYS = 7
+API_NOTIFICATIONS_LIMIT = 50
+SERVING_BATCH_SIZE = 50
+SERVING_QUEUE_LIMIT = 500
+
+
+_statement_hooks = []
+
+
+def trace_statement(sql):
+    for hook in _statement_hooks:
+        hook(sql)
+
+
+class ConnectionPool:
+    def __init__(self, path, size, readonly=False):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256,
+                               factory=ProfiledConnection if PROFILING else sqlite3.Connection)
+        conn.row_factory = sqlite3.Row
+        for name, value in DB_PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only = ON')
+        if _statement_hooks:
+            conn.set_trace_callback(trace_statement)
+        return conn
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                try:
+                    return self.connect()
+                except Exception:
+                    self.created -= 1
+                    raise
+        try:
+            return self.idle.get(timeout=DB_POOL_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError('Пул соединений с базой данных исчерпан')
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self.lock:
+                self.created -= 1
+            conn.close()
+            return
+        self.idle.put(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(readonly=False):
+    key = (os.getpid(), DATABASE, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                size = DB_READ_POOL_SIZE if readonly else DB_POOL_SIZE
+                pool = _pools[key] = ConnectionPool(DATABASE, size, readonly)
+    return pool
 
 
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = get_pool().acquire()
+    return db
+
+
+def get_read_db():
+    db = getattr(g, '_read_database', None)
+    if db is None:
+        db = g._read_database = get_pool(readonly=True).acquire()
     return db
 
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+    read_db = g.pop('_read_database', None)
+    if read_db is not None:
+        get_pool(readonly=True).release(read_db)
+
+
+_sql_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\bNULL\b", re.IGNORECASE)
+_sql_lists = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_sql_spaces = re.compile(r'\s+')
+
+
+def statement_shape(sql):
+    shape = _sql_literals.sub('?', _sql_spaces.sub(' ', sql).strip())
+    return _sql_lists.sub('(?, ...)', shape)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+
+def record_statement(sql, elapsed):
+    profile = g.get('_profile') if has_app_context() else None
+    if profile is not None:
+        profile.append((sql, elapsed))
+
+
+class RequestMetrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.statements = {}
+
+    def observe(self, endpoint, duration, statements):
+        with self.lock:
+            entry = self.requests.get(endpoint)
+            if entry is None:
+                entry = self.requests[endpoint] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0,
+                                                   'queries': 0}
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    entry['buckets'][i] += 1
+            entry['count'] += 1
+            entry['sum'] += duration
+            entry['queries'] += len(statements)
+            for sql, elapsed in statements:
+                shape = statement_shape(sql)
+                stats = self.statements.get(shape)
+                if stats is None:
+                    stats = self.statements[shape] = [0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+
+    def render(self):
+        def label(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = [
+            '# HELP canteen_request_duration_seconds Время обработки запроса',
+            '# TYPE canteen_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            requests = {endpoint: dict(entry, buckets=list(entry['buckets']))
+                        for endpoint, entry in self.requests.items()}
+            statements = {shape: list(stats) for shape, stats in self.statements.items()}
+        for endpoint, entry in sorted(requests.items()):
+            name = label(endpoint)
+            for bound, count in zip(self.buckets, entry['buckets']):
+                lines.append(f'canteen_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {count}')
+            lines.append(f'canteen_request_duration_seconds_bucket{{endpoint="{name}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'canteen_request_duration_seconds_sum{{endpoint="{name}"}} {entry["sum"]:.6f}')
+            lines.append(f'canteen_request_duration_seconds_count{{endpoint="{name}"}} {entry["count"]}')
+        lines += [
+            '# HELP canteen_request_queries_total Запросов к базе, выполненных обработчиком',
+            '# TYPE canteen_request_queries_total counter',
+        ]
+        lines += [f'canteen_request_queries_total{{endpoint="{label(endpoint)}"}} {entry["queries"]}'
+                  for endpoint, entry in sorted(requests.items())]
+        lines += [
+            '# HELP canteen_sql_statements_total Выполнений запросов по форме запроса',
+            '# TYPE canteen_sql_statements_total counter',
+        ]
+        lines += [f'canteen_sql_statements_total{{shape="{label(shape)}"}} {count}'
+                  for shape, (count, _) in sorted(statements.items())]
+        lines += [
+            '# HELP canteen_sql_statement_seconds_total Время выполнения запросов по форме запроса',
+            '# TYPE canteen_sql_statement_seconds_total counter',
+        ]
+        lines += [f'canteen_sql_statement_seconds_total{{shape="{label(shape)}"}} {elapsed:.6f}'
+                  for shape, (_, elapsed) in sorted(statements.items())]
+        return lines
+
+
+request_metrics = RequestMetrics(PROFILE_BUCKETS)
+
+
+@app.before_request
+def start_request_profile():
+    if PROFILING:
+        g._profile_started = time.perf_counter()
+        g._profile = []
+
+
+@app.teardown_request
+def finish_request_profile(exception):
+    statements = g.pop('_profile', None)
+    if statements is None:
+        return
+    duration = time.perf_counter() - g.pop('_profile_started')
+    endpoint = request.endpoint or 'unmatched'
+    request_metrics.observe(endpoint, duration, statements)
+    if duration >= SLOW_REQUEST_SECONDS:
+        app.logger.warning('Медленный запрос %s %s (%s): %.0f мс, %d запросов к базе\n%s',
+                           request.method, request.full_path.rstrip('?'), endpoint, duration * 1000,
+                           len(statements), '\n'.join(f'  {elapsed * 1000:8.2f} мс  {_sql_spaces.sub(" ", sql).strip()}'
+                                                      for sql, elapsed in statements))
+
+
+_sql_aliases = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|INNER\b|CROSS\b|GROUP\b|'
+                          r'ORDER\b|LIMIT\b|UNION\b|SET\b)(\w+))?', re.IGNORECASE)
+
+
+class QueryCheckError(AssertionError):
+    pass
+
+
+class QueryChecker:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.plans = {}
+        self.table_rows = {}
+
+    def rows(self, table):
+        if table not in self.table_rows:
+            self.table_rows[table] = self.conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        return self.table_rows[table]
+
+    def full_scans(self, shape, sql):
+        with self.lock:
+            if shape in self.plans:
+                return self.plans[shape]
+            if self.conn is None:
+                self.conn = ConnectionPool(self.path, 1, readonly=True).connect()
+            tables = {name for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            aliases = {}
+            for table, alias in _sql_aliases.findall(sql):
+                if table in tables:
+                    aliases[table] = aliases[alias or table] = table
+            scans = []
+            try:
+                plan = self.conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+            except sqlite3.Error:
+                plan = []
+            for row in plan:
+                parts = row['detail'].split()
+                if len(parts) >= 2 and parts[0] == 'SCAN' and parts[1] in aliases:
+                    table = aliases[parts[1]]
+                    if self.rows(table) >= QUERY_CHECK_SCAN_ROWS:
+                        scans.append(table)
+            self.plans[shape] = scans
+            return scans
+
+    def check(self, statements):
+        counts = {}
+        problems = []
+        for sql in statements:
+            verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+            if verb not in ('SELECT', 'WITH', 'UPDATE', 'DELETE'):
+                continue
+            shape = statement_shape(sql)
+            if shape in counts:
+                if verb in ('SELECT', 'WITH'):
+                    counts[shape] += 1
+                continue
+            counts[shape] = 1
+            if ' WHERE ' in shape.upper():
+                for table in self.full_scans(shape, sql):
+                    problems.append(f'полный просмотр {table} ({self.rows(table)} строк): {shape}')
+        problems += [f'N+1: {count} одинаковых запросов: {shape}'
+                     for shape, count in counts.items() if count > QUERY_CHECK_REPEAT_LIMIT]
+        return problems
+
+
+_query_checkers = {}
+
+
+def get_query_checker():
+    key = (os.getpid(), DATABASE)
+    checker = _query_checkers.get(key)
+    if checker is None:
+        checker = _query_checkers.setdefault(key, QueryChecker(DATABASE))
+    return checker
+
+
+def collect_query(sql):
+    if has_app_context():
+        log = g.get('_query_log')
+        # Срабатывание триггера приходит в trace callback повтором текста внешнего запроса.
+        if log is not None and (not log or log[-1] != sql):
+            log.append(sql)
+
+
+if QUERY_CHECK:
+    _statement_hooks.append(collect_query)
+
+
+@app.before_request
+def start_query_check():
+    if QUERY_CHECK:
+        g._query_log = []
+
+
+@app.after_request
+def finish_query_check(response):
+    statements = g.pop('_query_log', None)
+    if not statements:
+        return response
+    problems = get_query_checker().check(statements)
+    if problems:
+        message = f'{request.method} {request.path} ({request.endpoint}):\n  ' + '\n  '.join(problems)
+        if QUERY_CHECK == 'raise':
+            raise QueryCheckError(message)
+        app.logger.warning('Проблемные запросы в %s', message)
+    return response
 
 
 def init_db():
@@ -206,7 +608,7 @@ def init_db():
                 cursor.execute('''
                     INSERT INTO users (full_name, password_hash, role)
                     VALUES (?, ?, ?)
-                ''', (full_name, generate_password_hash(pwd), role))
+                ''', (full_name, hash_password(pwd), role))
                 if role == 'student':
                     user_id = cursor.lastrowid
                     cursor.execute('INSERT INTO student_profiles (user_id, balance) VALUES (?, 0.0)', (user_id,))
@@ -251,7 +653,7 @@ def init_db():
             ("Сахар", 10, "кг")
         ]
         for name, qty, unit in inventory:
-            cursor.execute("INSERT OR REPLACE INTO inventory (product_name, quantity, unit) VALUES (?, ?, ?)",
+            cursor.execute("INSERT OR IGNORE INTO inventory (product_name, quantity, unit) VALUES (?, ?, ?)",
                            (name, qty, unit))
 
         for i in range(2):
@@ -264,6 +666,569 @@ def init_db():
             ''', (day, "Овсяная каша", "Какао", "Борщ", "Котлета с картошкой", "Компот"))
 
         db.commit()
+        forget_role_user_ids()
+        migrate_db(db)
+    get_outbox().wake()
+
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+@migration(1, 'Индексы для горячих таблиц')
+def migration_hot_indexes(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_meal_records_student_taken ON meal_records(student_id, taken_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_meal_records_taken ON meal_records(taken_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications(user_id, is_read)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_at)')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_student_status_end
+        ON subscriptions(student_id, status, end_date)
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_purchase_requests_status ON purchase_requests(status)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_dish_recipes_dish ON dish_recipes(dish_name)')
+
+
+@migration(2, 'Уникальные ингредиенты в рецептах')
+def migration_unique_recipes(db):
+    db.execute('''
+        DELETE FROM dish_recipes
+        WHERE rowid NOT IN (SELECT MIN(rowid) FROM dish_recipes GROUP BY dish_name, ingredient)
+    ''')
+    db.execute('DROP INDEX IF EXISTS idx_dish_recipes_dish')
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_dish_recipes_dish_ingredient ON dish_recipes(dish_name, ingredient)')
+
+
+@migration(3, 'Версия каталога блюд и меню')
+def migration_catalog_version(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    db.execute('INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)')
+    for table in ('dishes', 'dish_recipes', 'menu_sets'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_catalog
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE catalog_version SET version = version + 1;
+                END
+            ''')
+
+
+@migration(4, 'Битовые маски ингредиентов, аллергий и предпочтений')
+def migration_ingredient_masks(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS ingredients (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    db.execute('ALTER TABLE student_profiles ADD COLUMN allergy_mask TEXT')
+    db.execute('ALTER TABLE student_profiles ADD COLUMN preference_mask TEXT')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ingredients_insert_catalog
+        AFTER INSERT ON ingredients
+        BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END
+    ''')
+    intern_ingredients(db, [row[0] for row in db.execute('SELECT DISTINCT ingredient FROM dish_recipes')])
+    profiles = db.execute('SELECT user_id, allergies, preferences FROM student_profiles').fetchall()
+    for user_id, allergies, preferences in profiles:
+        update_student_masks(db, user_id, allergies, preferences)
+
+
+@migration(5, 'Счётчик непрочитанных уведомлений')
+def migration_unread_counter(db):
+    db.execute('ALTER TABLE users ADD COLUMN unread_notifications INTEGER NOT NULL DEFAULT 0')
+    db.execute('''
+        UPDATE users SET unread_notifications = (
+            SELECT COUNT(*) FROM notifications n WHERE n.user_id = users.id AND n.is_read = 0
+        )
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notifications_insert_unread
+        AFTER INSERT ON notifications WHEN NEW.is_read = 0
+        BEGIN
+            UPDATE users SET unread_notifications = unread_notifications + 1 WHERE id = NEW.user_id;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notifications_update_unread
+        AFTER UPDATE OF is_read ON notifications WHEN OLD.is_read != NEW.is_read
+        BEGIN
+            UPDATE users SET unread_notifications = unread_notifications + (CASE WHEN NEW.is_read = 0 THEN 1 ELSE -1 END)
+            WHERE id = NEW.user_id;
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_notifications_delete_unread
+        AFTER DELETE ON notifications WHEN OLD.is_read = 0
+        BEGIN
+            UPDATE users SET unread_notifications = unread_notifications - 1 WHERE id = OLD.user_id;
+        END
+    ''')
+
+
+@migration(6, 'Ежедневная статистика')
+def migration_daily_stats(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day DATE PRIMARY KEY,
+            payments_total REAL NOT NULL DEFAULT 0,
+            payments_one_time REAL NOT NULL DEFAULT 0,
+            payments_subscription REAL NOT NULL DEFAULT 0,
+            meals_breakfast INTEGER NOT NULL DEFAULT 0,
+            meals_lunch INTEGER NOT NULL DEFAULT 0,
+            attendees INTEGER NOT NULL DEFAULT 0,
+            new_students INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_insert_stats
+        AFTER INSERT ON payments
+        BEGIN
+            INSERT OR IGNORE INTO daily_stats (day) VALUES (date(NEW.created_at));
+            UPDATE daily_stats SET
+                payments_total = payments_total + NEW.amount,
+                payments_one_time = payments_one_time + (CASE WHEN NEW.payment_type = 'subscription' THEN 0 ELSE NEW.amount END),
+                payments_subscription = payments_subscription + (CASE WHEN NEW.payment_type = 'subscription' THEN NEW.amount ELSE 0 END)
+            WHERE day = date(NEW.created_at);
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_meal_records_insert_stats
+        AFTER INSERT ON meal_records
+        BEGIN
+            INSERT OR IGNORE INTO daily_stats (day) VALUES (date(NEW.taken_at));
+            UPDATE daily_stats SET
+                meals_breakfast = meals_breakfast + (NEW.meal_type = 'breakfast'),
+                meals_lunch = meals_lunch + (NEW.meal_type = 'lunch'),
+                attendees = attendees + NOT EXISTS (
+                    SELECT 1 FROM meal_records
+                    WHERE student_id = NEW.student_id AND id != NEW.id
+                      AND taken_at >= date(NEW.taken_at) AND taken_at < date(NEW.taken_at, '+1 day')
+                )
+            WHERE day = date(NEW.taken_at);
+        END
+    ''')
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_insert_stats
+        AFTER INSERT ON users WHEN NEW.role = 'student'
+        BEGIN
+            INSERT OR IGNORE INTO daily_stats (day) VALUES (date(NEW.created_at));
+            UPDATE daily_stats SET new_students = new_students + 1 WHERE day = date(NEW.created_at);
+        END
+    ''')
+    rebuild_daily_stats(db)
+
+
+def rebuild_daily_stats(db):
+    db.execute('DELETE FROM daily_stats')
+    db.execute('''
+        INSERT INTO daily_stats (day, payments_total, payments_one_time, payments_subscription,
+                                 meals_breakfast, meals_lunch, attendees, new_students)
+        SELECT day, SUM(payments_total), SUM(payments_one_time), SUM(payments_subscription),
+               SUM(meals_breakfast), SUM(meals_lunch), SUM(attendees), SUM(new_students)
+        FROM (
+            SELECT date(created_at) AS day, SUM(amount) AS payments_total,
+                   SUM(CASE WHEN payment_type = 'subscription' THEN 0 ELSE amount END) AS payments_one_time,
+                   SUM(CASE WHEN payment_type = 'subscription' THEN amount ELSE 0 END) AS payments_subscription,
+                   0 AS meals_breakfast, 0 AS meals_lunch, 0 AS attendees, 0 AS new_students
+            FROM payments GROUP BY date(created_at)
+            UNION ALL
+            SELECT date(taken_at), 0, 0, 0,
+                   SUM(meal_type = 'breakfast'), SUM(meal_type = 'lunch'), COUNT(DISTINCT student_id), 0
+            FROM meal_records GROUP BY date(taken_at)
+            UNION ALL
+            SELECT date(created_at), 0, 0, 0, 0, 0, 0, COUNT(*)
+            FROM users WHERE role = 'student' GROUP BY date(created_at)
+        )
+        WHERE day IS NOT NULL
+        GROUP BY day
+    ''')
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    rebuild_daily_stats(db)
+    db.commit()
+    days = db.execute('SELECT COUNT(*) FROM daily_stats').fetchone()[0]
+    print(f'Статистика пересчитана: {days} дн.')
+
+
+@migration(7, 'Индексы для ленты операций')
+def migration_operations_feed(db):
+    db.execute('ALTER TABLE purchase_requests ADD COLUMN approved_at TIMESTAMP')
+    db.execute("UPDATE purchase_requests SET approved_at = created_at WHERE status = 'approved'")
+    db.execute('CREATE INDEX IF NOT EXISTS idx_purchase_requests_approved ON purchase_requests(approved_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_payments_student_created ON payments(student_id, created_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_created ON subscriptions(created_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_student_created ON subscriptions(student_id, created_at)')
+
+
+@migration(8, 'Журнал ротации ключа карт')
+def migration_card_key_rotations(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS card_key_rotations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key_fingerprint TEXT NOT NULL,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running' CHECK(status IN ('running', 'done')),
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
+
+@migration(9, 'Журнал движения продуктов и снимки остатков')
+def migration_inventory_ledger(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_movements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_name TEXT NOT NULL,
+            delta REAL NOT NULL,
+            kind TEXT NOT NULL CHECK(kind IN ('consume', 'prepare', 'receive', 'adjust')),
+            source TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(product_name) REFERENCES inventory(product_name)
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_inventory_movements_product ON inventory_movements(product_name)')
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_inventory_movements_product_created
+        ON inventory_movements(product_name, created_at)
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_snapshot_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            last_movement_id INTEGER NOT NULL,
+            taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_inventory_snapshot_runs_taken ON inventory_snapshot_runs(taken_at)')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_snapshots (
+            run_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            PRIMARY KEY (run_id, product_name),
+            FOREIGN KEY(run_id) REFERENCES inventory_snapshot_runs(id)
+        )
+    ''')
+    db.execute('''
+        CREATE VIEW IF NOT EXISTS inventory_stock AS
+        SELECT i.product_name, i.unit,
+               i.quantity + COALESCE((
+                   SELECT SUM(m.delta) FROM inventory_movements m
+                   WHERE m.product_name = i.product_name
+                     AND m.id > (SELECT last_movement_id FROM inventory_snapshot_runs ORDER BY id DESC LIMIT 1)
+               ), 0) AS quantity
+        FROM inventory i
+    ''')
+    run_id = db.execute('INSERT INTO inventory_snapshot_runs (last_movement_id) VALUES (0)').lastrowid
+    db.execute('''
+        INSERT INTO inventory_snapshots (run_id, product_name, quantity)
+        SELECT ?, product_name, quantity FROM inventory
+    ''', (run_id,))
+
+
+@migration(10, 'Позиции заявок на закупку')
+def migration_purchase_request_items(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS purchase_request_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity REAL NOT NULL CHECK(quantity > 0),
+            unit TEXT NOT NULL,
+            FOREIGN KEY(request_id) REFERENCES purchase_requests(id)
+        )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_purchase_request_items_request ON purchase_request_items(request_id)')
+    units = dict(db.execute('SELECT product_name, unit FROM inventory').fetchall())
+    db.executemany('''
+        INSERT INTO purchase_request_items (request_id, product_name, quantity, unit)
+        VALUES (?, ?, ?, ?)
+    ''', [(request_id, product_name, quantity, units.get(product_name, 'шт'))
+          for request_id, items in db.execute('SELECT id, items FROM purchase_requests').fetchall()
+          for product_name, quantity in parse_purchase_items(items)])
+
+
+@migration(11, 'Индекс пользователей по роли')
+def migration_users_role_index(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_users_role_name ON users(role, full_name)')
+
+
+@migration(12, 'Очередь исходящих уведомлений')
+def migration_notification_outbox(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migration(13, 'Ежедневный снимок остатков при первом движении за день')
+def migration_daily_inventory_snapshot(db):
+    # Те же шаги, что в take_inventory_snapshot(), но до первой записи в журнал за сутки:
+    # снимок фиксирует остатки на начало дня, и stock_on() есть от чего считать.
+    db.execute('''
+        CREATE TRIGGER IF NOT EXISTS inventory_movements_daily_snapshot
+        BEFORE INSERT ON inventory_movements
+        WHEN NOT EXISTS (SELECT 1 FROM inventory_snapshot_runs WHERE taken_at >= date('now'))
+        BEGIN
+            INSERT INTO inventory_snapshot_runs (last_movement_id)
+            SELECT COALESCE(MAX(id), 0) FROM inventory_movements;
+            INSERT INTO inventory_snapshots (run_id, product_name, quantity)
+            SELECT (SELECT MAX(id) FROM inventory_snapshot_runs), i.product_name, i.quantity + COALESCE((
+                SELECT SUM(m.delta) FROM inventory_movements m
+                WHERE m.product_name = i.product_name AND m.id > (
+                    SELECT last_movement_id FROM inventory_snapshot_runs ORDER BY id DESC LIMIT 1 OFFSET 1
+                )
+            ), 0)
+            FROM inventory i;
+            UPDATE inventory SET quantity = (
+                SELECT quantity FROM inventory_snapshots s
+                WHERE s.run_id = (SELECT MAX(id) FROM inventory_snapshot_runs)
+                  AND s.product_name = inventory.product_name
+            );
+        END
+    ''')
+
+
+@migration(14, 'Новые ингредиенты не меняют версию каталога')
+def migration_ingredients_keep_catalog_version(db):
+    # Блюда и рецепты сами меняют версию каталога; слова из профилей учеников на маски блюд не влияют.
+    db.execute('DROP TRIGGER IF EXISTS trg_ingredients_insert_catalog')
+
+
+def get_schema_version(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate_db(db):
+    current = get_schema_version(db)
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # Версию перечитываем под блокировкой записи: соседний процесс, стартовавший одновременно,
+            # мог уже применить этот шаг, а ALTER TABLE ADD COLUMN повторно не выполнить.
+            current = db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+            if version <= current:
+                db.rollback()
+                continue
+            func(db)
+            db.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+    if applied:
+        db.execute('ANALYZE')
+    return applied
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    db = get_db()
+    before = get_schema_version(db)
+    applied = migrate_db(db)
+    if applied:
+        print(f'Схема обновлена: {before} -> {applied[-1]}')
+    else:
+        print(f'Схема актуальна (версия {before})')
+
+
+def parse_ingredient_list(text):
+    return {item.strip().lower() for item in (text or '').split(',') if item.strip()}
+
+
+def intern_ingredients(db, names):
+    names = {name.strip().lower() for name in names if name and name.strip()}
+    if not names:
+        return {}
+    db.executemany('INSERT OR IGNORE INTO ingredients (name) VALUES (?)', [(name,) for name in names])
+    placeholders = ', '.join('?' * len(names))
+    return dict(db.execute(f'SELECT name, id FROM ingredients WHERE name IN ({placeholders})',
+                           list(names)).fetchall())
+
+
+def ingredient_mask(ids):
+    mask = 0
+    for ingredient_id in ids:
+        mask |= 1 << ingredient_id
+    return mask
+
+
+def mask_bits(mask):
+    bit = 0
+    while mask:
+        if mask & 1:
+            yield bit
+        mask >>= 1
+        bit += 1
+
+
+def update_student_masks(db, user_id, allergies, preferences):
+    allergy_names = parse_ingredient_list(allergies)
+    preference_names = parse_ingredient_list(preferences)
+    ids = intern_ingredients(db, allergy_names | preference_names)
+    allergy_mask = ingredient_mask(ids[name] for name in allergy_names)
+    preference_mask = ingredient_mask(ids[name] for name in preference_names)
+    db.execute('UPDATE student_profiles SET allergy_mask = ?, preference_mask = ? WHERE user_id = ?',
+               (format(allergy_mask, 'x'), format(preference_mask, 'x'), user_id))
+    return allergy_mask, preference_mask
+
+
+class Catalog:
+    def __init__(self, version, dishes, recipes, menus, ingredient_ids):
+        self.version = version
+        self.dishes = dishes
+        self.prices = {d['name']: d['price'] for d in dishes}
+        self.recipes = recipes
+        self.menus = menus
+        self._recipe_matrix = None
+        self.ingredient_names = {ingredient_id: name for name, ingredient_id in ingredient_ids.items()}
+        self.dish_masks = {
+            dish: ingredient_mask(ingredient_ids[ing['ingredient'].lower()] for ing in ingredients
+                                  if ing['ingredient'].lower() in ingredient_ids)
+            for dish, ingredients in recipes.items()
+        }
+
+    def mask_names(self, mask, db=None):
+        missing = [bit for bit in mask_bits(mask) if bit not in self.ingredient_names]
+        if missing and db is not None:
+            # Слова из профилей попадают в ingredients без смены версии каталога; id за именем не меняется,
+            # поэтому догружаем их в уже собранный каталог.
+            placeholders = ', '.join('?' * len(missing))
+            self.ingredient_names.update(db.execute(f'SELECT id, name FROM ingredients WHERE id IN ({placeholders})',
+                                                    missing).fetchall())
+        return [self.ingredient_names[bit] for bit in mask_bits(mask) if bit in self.ingredient_names]
+
+    def menu_flags(self, menus, allergy_mask, preference_mask):
+        allergen_warnings = {}
+        preference_matches = {}
+        for menu in menus:
+            for dish in meal_dishes(menu, 'breakfast') + meal_dishes(menu, 'lunch'):
+                dish_mask = self.dish_masks.get(dish, 0)
+                if dish_mask & allergy_mask:
+                    allergen_warnings[dish] = True
+                if dish_mask & preference_mask:
+                    preference_matches[dish] = True
+        return allergen_warnings, preference_matches
+
+    def menu_for(self, day):
+        return self.menus.get(str(day))
+
+    def recipe_matrix(self):
+        if self._recipe_matrix is None:
+            dish_index = {d['name']: i for i, d in enumerate(self.dishes)}
+            units = {}
+            for dish in dish_index:
+                for ing in self.recipes.get(dish, []):
+                    units.setdefault(ing['ingredient'], ing['unit'])
+            ingredient_index = {name: i for i, name in enumerate(units)}
+            matrix = np.zeros((len(dish_index), len(ingredient_index)))
+            for dish, row in dish_index.items():
+                for ing in self.recipes.get(dish, []):
+                    matrix[row, ingredient_index[ing['ingredient']]] += ing['quantity']
+            self._recipe_matrix = dish_index, list(units), list(units.values()), matrix
+        return self._recipe_matrix
+
+    def search(self, text):
+        text = text.lower()
+        return [d for d in self.dishes if text in d['name'].lower()]
+
+
+def load_catalog(db, version):
+    dishes = [dict(row) for row in db.execute('SELECT name, price FROM dishes ORDER BY name')]
+    prices = {d['name']: d['price'] for d in dishes}
+
+    recipes = {d['name']: [] for d in dishes}
+    for row in db.execute('SELECT dish_name, ingredient, quantity, unit FROM dish_recipes ORDER BY rowid'):
+        recipes.setdefault(row['dish_name'], []).append({
+            'ingredient': row['ingredient'],
+            'quantity': row['quantity'],
+            'unit': row['unit']
+        })
+
+    menus = {}
+    for row in db.execute('SELECT * FROM menu_sets'):
+        menu = dict(row)
+        menu['breakfast_price'] = sum(prices.get(d, 0) for d in meal_dishes(menu, 'breakfast'))
+        menu['lunch_price'] = sum(prices.get(d, 0) for d in meal_dishes(menu, 'lunch'))
+        menus[str(menu['meal_date'])] = menu
+
+    ingredient_ids = dict(db.execute('SELECT name, id FROM ingredients').fetchall())
+
+    return Catalog(version, dishes, recipes, menus, ingredient_ids)
+
+
+_catalog = {}
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(db):
+    now = time.monotonic()
+    cached = _catalog.get(DATABASE)
+    if cached and now - cached['checked_at'] < CATALOG_CHECK_INTERVAL:
+        return cached['catalog']
+    with _catalog_lock:
+        version = db.execute('SELECT version FROM catalog_version').fetchone()[0]
+        cached = _catalog.get(DATABASE)
+        if cached and cached['catalog'].version == version:
+            catalog = cached['catalog']
+        else:
+            catalog = load_catalog(db, version)
+        _catalog[DATABASE] = {'catalog': catalog, 'checked_at': now}
+    return catalog
+
+
+def invalidate_catalog():
+    cached = _catalog.get(DATABASE)
+    if cached:
+        cached['checked_at'] = 0
+
+
+def meal_dishes(menu_set, meal_type):
+    if meal_type == 'breakfast':
+        return [menu_set['breakfast_main'], menu_set['breakfast_drink']]
+    return [menu_set['lunch_first'], menu_set['lunch_second'], menu_set['lunch_drink']]
+
+
+def day_range(day):
+    return day.isoformat(), (day + timedelta(days=1)).isoformat()
 
 
 def has_active_subscription(student_id, db):
@@ -275,15 +1240,984 @@ def has_active_subscription(student_id, db):
     return sub is not None
 
 
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+
+class VerifierOverloaded(Exception):
+    pass
+
+
+class PasswordVerifier:
+    def __init__(self, workers, queue_limit):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.busy_time = 0.0
+
+    def run(self, func, *args):
+        with self.lock:
+            if self.pending >= self.queue_limit:
+                self.rejected += 1
+                raise VerifierOverloaded()
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            result = func(*args)
+            return result, started - submitted, time.perf_counter() - started
+
+        try:
+            result, waited, spent = self.executor.submit(task).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+        with self.lock:
+            self.completed += 1
+            self.wait_time += waited
+            self.busy_time += spent
+        return result
+
+    def verify(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.pending,
+                'max_queue_depth': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_wait': self.wait_time / self.completed if self.completed else 0.0,
+                'avg_hash_time': self.busy_time / self.completed if self.completed else 0.0
+            }
+
+
+_verifiers = {}
+
+
+def get_password_verifier():
+    verifier = _verifiers.get(os.getpid())
+    if verifier is None:
+        verifier = _verifiers.setdefault(os.getpid(), PasswordVerifier(LOGIN_WORKERS, LOGIN_QUEUE_LIMIT))
+    return verifier
+
+
+@app.cli.command('bench-login')
+@click.option('--logins', default=200, help='Количество входов на каждую настройку')
+@click.option('--clients', default=32, help='Количество одновременных клиентов')
+@click.option('--method', 'methods', multiple=True, help='Параметры хеширования, например pbkdf2:sha256:600000')
+def bench_login_command(logins, clients, methods):
+    methods = methods or (PASSWORD_HASH_METHOD, 'scrypt:16384:8:1', 'pbkdf2:sha256:600000')
+    cores = min(LOGIN_WORKERS, os.cpu_count() or 1)
+    for method in methods:
+        stored = generate_password_hash('benchmark', method=method)
+        verifier = PasswordVerifier(LOGIN_WORKERS, logins)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            ok = all(pool.map(lambda _: verifier.verify(stored, 'benchmark'), range(logins)))
+        elapsed = time.perf_counter() - started
+        m = verifier.metrics()
+        rate = logins / elapsed
+        print(f'{method}: {rate:.1f} входов/с, {rate / cores:.1f} на ядро ({cores} яд.), '
+              f'хеш {m["avg_hash_time"] * 1000:.0f} мс, ожидание {m["avg_wait"] * 1000:.0f} мс, '
+              f'очередь до {m["max_queue_depth"]}{"" if ok else ", ОШИБКА ПРОВЕРКИ"}')
+        verifier.executor.shutdown()
+
+
+_unread_cache = {}
+
+
 def get_unread_notifications_count(user_id, db):
-    count = db.execute('SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = 0', (user_id,)).fetchone()
-    return count[0] if count else 0
+    now = time.monotonic()
+    cached = _unread_cache.get((DATABASE, user_id))
+    if cached and cached[1] > now:
+        return cached[0]
+    row = db.execute('SELECT unread_notifications FROM users WHERE id = ?', (user_id,)).fetchone()
+    count = row[0] if row else 0
+    if UNREAD_CACHE_TTL:
+        _unread_cache[(DATABASE, user_id)] = (count, now + UNREAD_CACHE_TTL)
+    return count
+
+
+def forget_unread_count(*user_ids):
+    for user_id in user_ids:
+        _unread_cache.pop((DATABASE, user_id), None)
+
+
+def is_busy_error(exc):
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    code = getattr(exc, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(exc)
+
+
+class NotificationOutbox:
+    # Уведомления пишутся в notification_outbox в той же транзакции, что и само изменение,
+    # поэтому переживают остановку процесса. Поток только переносит строки в notifications:
+    # сразу после запроса, в котором что-то было поставлено, и раз в OUTBOX_POLL_INTERVAL —
+    # это подбирает строки, оставшиеся от прошлого запуска или других процессов.
+    def __init__(self, path):
+        self.path = path
+        self.thread = None
+        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.requested = 0
+        self.delivered = 0
+        self.stopping = False
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping = False
+                self.thread = threading.Thread(target=self.run, name='notification-outbox', daemon=True)
+                self.thread.start()
+
+    def wake(self):
+        self.start()
+        with self.cond:
+            self.requested += 1
+            self.cond.notify_all()
+
+    def stop(self, timeout=OUTBOX_FLUSH_TIMEOUT):
+        with self.lock:
+            thread = self.thread
+            with self.cond:
+                self.stopping = True
+                self.cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def deliver(self, db, limit):
+        # Пустая очередь — обычное состояние; проверяем её без блокировки записи,
+        # чтобы опрос раз в секунду не мешал оплатам и выдаче.
+        if db.execute('SELECT 1 FROM notification_outbox WHERE attempts < ? LIMIT 1',
+                      (OUTBOX_MAX_ATTEMPTS,)).fetchone() is None:
+            return 0
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            params = {'max_attempts': OUTBOX_MAX_ATTEMPTS}
+            params['max_id'] = db.execute('''
+                SELECT MAX(id) FROM (
+                    SELECT id FROM notification_outbox WHERE attempts < :max_attempts ORDER BY id LIMIT :limit
+                )
+            ''', dict(params, limit=limit)).fetchone()[0]
+            user_ids = [row[0] for row in db.execute('''
+                SELECT DISTINCT user_id FROM notification_outbox WHERE id <= :max_id AND attempts < :max_attempts
+            ''', params)]
+            delivered = db.execute('''
+                INSERT INTO notifications (user_id, message, created_at)
+                SELECT user_id, message, created_at FROM notification_outbox
+                WHERE id <= :max_id AND attempts < :max_attempts
+                ORDER BY id
+            ''', params).rowcount
+            db.execute('DELETE FROM notification_outbox WHERE id <= :max_id AND attempts < :max_attempts', params)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        forget_unread_count(*user_ids)
+        return delivered
+
+    def postpone(self, db):
+        try:
+            row = db.execute('SELECT id, attempts FROM notification_outbox WHERE attempts < ? ORDER BY id LIMIT 1',
+                             (OUTBOX_MAX_ATTEMPTS,)).fetchone()
+            if row:
+                db.execute('UPDATE notification_outbox SET attempts = attempts + 1 WHERE id = ?', (row['id'],))
+                db.commit()
+                if row['attempts'] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                    app.logger.error('Уведомление №%d не доставлено после %d попыток и оставлено в notification_outbox; '
+                                     'вернуть в очередь: flask requeue-notifications',
+                                     row['id'], OUTBOX_MAX_ATTEMPTS)
+        except sqlite3.Error:
+            db.rollback()
+            app.logger.exception('Не удалось отметить неудачную доставку уведомления')
+
+    def run(self):
+        db = ConnectionPool(self.path, 1).connect()
+        limit = OUTBOX_BATCH_SIZE
+        delay = OUTBOX_RETRY_DELAY
+        while True:
+            with self.cond:
+                if self.stopping:
+                    break
+                target = self.requested
+            try:
+                delivered = self.deliver(db, limit)
+            except sqlite3.Error as exc:
+                if is_busy_error(exc):
+                    # База занята другими записями — уведомление тут ни при чём, попытку не считаем.
+                    app.logger.warning('База данных занята, доставка уведомлений отложена на %s с', delay)
+                else:
+                    app.logger.exception('Не удалось доставить уведомления, повтор через %s с', delay)
+                    # Пачку, которая не проходит, дробим до одной строки; у одиночной строки считаем попытки,
+                    # чтобы она не держала очередь бесконечно.
+                    if limit == 1:
+                        self.postpone(db)
+                    limit = max(limit // 2, 1)
+                with self.cond:
+                    self.cond.wait_for(lambda: self.stopping, delay)
+                delay = min(delay * 2, OUTBOX_RETRY_DELAY_MAX)
+                continue
+            delay = OUTBOX_RETRY_DELAY
+            if delivered == limit:
+                limit = min(limit * 2, OUTBOX_BATCH_SIZE)
+                continue
+            with self.cond:
+                self.delivered = target
+                self.cond.notify_all()
+                if self.requested == target and not self.stopping:
+                    self.cond.wait(OUTBOX_POLL_INTERVAL)
+        db.close()
+
+    def flush(self, timeout=OUTBOX_FLUSH_TIMEOUT):
+        if self.thread is None or not self.thread.is_alive():
+            return True
+        with self.cond:
+            self.requested += 1
+            target = self.requested
+            self.cond.notify_all()
+            return self.cond.wait_for(lambda: self.delivered >= target, timeout)
+
+
+_outboxes = {}
 
 
-def send_notification(user_id, message):
+def get_outbox():
+    key = (os.getpid(), DATABASE)
+    outbox = _outboxes.get(key)
+    if outbox is None:
+        outbox = _outboxes.setdefault(key, NotificationOutbox(DATABASE))
+    return outbox
+
+
+@atexit.register
+def flush_outboxes():
+    for outbox in list(_outboxes.values()):
+        outbox.flush()
+
+
+def close_outboxes(path):
+    for key in [key for key in _outboxes if key[1] == path]:
+        _outboxes.pop(key).stop()
+
+
+@app.cli.command('requeue-notifications')
+def requeue_notifications_command():
     db = get_db()
-    db.execute('INSERT INTO notifications (user_id, message) VALUES (?, ?)', (user_id, message))
+    db.execute('BEGIN IMMEDIATE')
+    requeued = db.execute('UPDATE notification_outbox SET attempts = 0 WHERE attempts >= ?',
+                          (OUTBOX_MAX_ATTEMPTS,)).rowcount
     db.commit()
+    if requeued:
+        get_outbox().wake()
+    print(f'Возвращено в очередь уведомлений: {requeued}')
+
+
+def stage_notifications(db, messages):
+    db.executemany('INSERT INTO notification_outbox (user_id, message) VALUES (?, ?)', messages)
+    if has_app_context():
+        g._notifications_staged = True
+    else:
+        get_outbox().wake()
+
+
+@app.teardown_appcontext
+def wake_notification_outbox(exception):
+    if g.pop('_notifications_staged', False):
+        get_outbox().wake()
+
+
+def send_notification(db, user_id, message):
+    stage_notifications(db, [(user_id, message)])
+
+
+_role_cache = {}
+
+
+def get_role_user_ids(db, role):
+    now = time.monotonic()
+    cached = _role_cache.get((DATABASE, role))
+    if cached and cached[1] > now:
+        return cached[0]
+    user_ids = [row[0] for row in db.execute('SELECT id FROM users WHERE role = ?', (role,))]
+    _role_cache[(DATABASE, role)] = (user_ids, now + ROLE_CACHE_TTL)
+    return user_ids
+
+
+def forget_role_user_ids():
+    for key in [key for key in _role_cache if key[0] == DATABASE]:
+        _role_cache.pop(key, None)
+
+
+def notify_role(db, role, message):
+    stage_notifications(db, [(user_id, message) for user_id in get_role_user_ids(db, role)])
+
+
+def parse_purchase_items(text):
+    items = []
+    for line in text.strip().split('\n'):
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        try:
+            quantity = float(parts[-1].replace(',', '.'))
+        except ValueError:
+            continue
+        if math.isfinite(quantity) and quantity > 0:
+            items.append((' '.join(parts[:-1]), quantity))
+    return items
+
+
+class PurchaseRequestError(Exception):
+    pass
+
+
+def create_purchase_request(db, cook_id, cook_name, lines):
+    units = dict(db.execute('SELECT product_name, unit FROM inventory').fetchall())
+    items = []
+    for product_name, quantity, unit in lines:
+        product_name = product_name.strip()
+        unit = unit.strip()
+        if not product_name:
+            continue
+        try:
+            quantity = float(quantity.replace(',', '.'))
+        except ValueError:
+            raise PurchaseRequestError(f'Неверное количество для "{product_name}"')
+        if not math.isfinite(quantity):
+            raise PurchaseRequestError(f'Неверное количество для "{product_name}"')
+        if quantity <= 0:
+            raise PurchaseRequestError(f'Количество для "{product_name}" должно быть больше нуля')
+        known_unit = units.get(product_name)
+        if known_unit and unit and unit != known_unit:
+            raise PurchaseRequestError(f'"{product_name}" учитывается на складе в {known_unit}, а не в {unit}')
+        items.append((product_name, quantity, known_unit or unit or 'шт'))
+    if not items:
+        raise PurchaseRequestError('Добавьте хотя бы один продукт')
+
+    summary = '\n'.join(f'{product_name} {quantity:g} {unit}' for product_name, quantity, unit in items)
+    request_id = db.execute('INSERT INTO purchase_requests (cook_id, items) VALUES (?, ?)',
+                            (cook_id, summary)).lastrowid
+    db.executemany('''
+        INSERT INTO purchase_request_items (request_id, product_name, quantity, unit)
+        VALUES (?, ?, ?, ?)
+    ''', [(request_id, product_name, quantity, unit) for product_name, quantity, unit in items])
+    notify_role(db, 'admin', f'Новая заявка от повара {cook_name}')
+    db.commit()
+    return request_id
+
+
+def approve_purchase_requests(db, admin_id, request_ids):
+    request_ids = list(dict.fromkeys(request_ids))
+    if not request_ids:
+        return []
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        placeholders = ', '.join('?' * len(request_ids))
+        approved = db.execute(f'''
+            SELECT id, cook_id FROM purchase_requests
+            WHERE status = 'pending' AND id IN ({placeholders})
+        ''', request_ids).fetchall()
+        if approved:
+            approved_ids = [row['id'] for row in approved]
+            placeholders = ', '.join('?' * len(approved_ids))
+            items = db.execute(f'''
+                SELECT request_id, product_name, quantity, unit FROM purchase_request_items
+                WHERE request_id IN ({placeholders})
+            ''', approved_ids).fetchall()
+            db.executemany('''
+                INSERT INTO inventory (product_name, quantity, unit) VALUES (?, 0, ?)
+                ON CONFLICT(product_name) DO NOTHING
+            ''', [(item['product_name'], item['unit']) for item in items])
+            db.executemany('''
+                INSERT INTO inventory_movements (product_name, delta, kind, source)
+                VALUES (?, ?, 'receive', ?)
+            ''', [(item['product_name'], item['quantity'], f'purchase_requests:{item["request_id"]}')
+                  for item in items])
+            db.execute(f'''
+                UPDATE purchase_requests
+                SET status = 'approved', approved_by = ?, approved_at = CURRENT_TIMESTAMP
+                WHERE id IN ({placeholders})
+            ''', [admin_id] + approved_ids)
+            stage_notifications(db, [(row['cook_id'], f'Ваша заявка №{row["id"]} одобрена! Продукты добавлены на склад.')
+                                     for row in approved])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return approved
+
+
+def record_movements(db, kind, source, deltas):
+    db.executemany('''
+        INSERT INTO inventory_movements (product_name, delta, kind, source)
+        VALUES (?, ?, ?, ?)
+    ''', [(product_name, delta, kind, source) for product_name, delta in deltas])
+
+
+def take_inventory_snapshot(db):
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        last_movement_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM inventory_movements').fetchone()[0]
+        run_id = db.execute('INSERT INTO inventory_snapshot_runs (last_movement_id) VALUES (?)',
+                            (last_movement_id,)).lastrowid
+        db.execute('''
+            INSERT INTO inventory_snapshots (run_id, product_name, quantity)
+            SELECT ?, product_name, i.quantity + COALESCE((
+                SELECT SUM(m.delta) FROM inventory_movements m
+                WHERE m.product_name = i.product_name AND m.id > (
+                    SELECT last_movement_id FROM inventory_snapshot_runs WHERE id < ? ORDER BY id DESC LIMIT 1
+                )
+            ), 0)
+            FROM inventory i
+        ''', (run_id, run_id))
+        db.execute('''
+            UPDATE inventory SET quantity = (
+                SELECT quantity FROM inventory_snapshots s
+                WHERE s.run_id = ? AND s.product_name = inventory.product_name
+            )
+        ''', (run_id,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return run_id
+
+
+def stock_on(db, day):
+    day_end = (day + timedelta(days=1)).isoformat()
+    run = db.execute('''
+        SELECT id, last_movement_id FROM inventory_snapshot_runs
+        WHERE taken_at < ? ORDER BY taken_at DESC, id DESC LIMIT 1
+    ''', (day_end,)).fetchone()
+    if not run:
+        return None
+    return db.execute('''
+        SELECT i.product_name, i.unit, COALESCE(s.quantity, 0) + COALESCE((
+            SELECT SUM(m.delta) FROM inventory_movements m
+            WHERE m.product_name = i.product_name AND m.id > ? AND m.created_at < ?
+        ), 0) AS quantity
+        FROM inventory i
+        LEFT JOIN inventory_snapshots s ON s.run_id = ? AND s.product_name = i.product_name
+        ORDER BY i.product_name
+    ''', (run['last_movement_id'], day_end, run['id'])).fetchall()
+
+
+@app.cli.command('snapshot-inventory')
+def snapshot_inventory_command():
+    db = get_db()
+    run_id = take_inventory_snapshot(db)
+    products = db.execute('SELECT COUNT(*) FROM inventory_snapshots WHERE run_id = ?', (run_id,)).fetchone()[0]
+    print(f'Снимок остатков №{run_id}: {products} продуктов')
+
+
+def cookable_portions(catalog, stock, dishes=None):
+    dish_index, ingredients, _, recipe_matrix = catalog.recipe_matrix()
+    dishes = list(dishes if dishes is not None else catalog.recipes)
+    capacity = {dish: {'portions': None, 'limiting': None} for dish in dishes}
+    known = [dish for dish in dishes if dish in dish_index]
+    if not known or not ingredients:
+        return capacity
+
+    available = np.array([max(stock.get(name, 0), 0) for name in ingredients])
+    needs = recipe_matrix[[dish_index[dish] for dish in known]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        can_make = np.where(needs > 0, np.floor((available + 1e-9) / needs), np.inf)
+    portions = can_make.min(axis=1)
+    limiting = can_make.argmin(axis=1)
+    for dish, count, i in zip(known, portions, limiting):
+        if np.isfinite(count):
+            capacity[dish] = {'portions': int(count), 'limiting': ingredients[i]}
+    return capacity
+
+
+def unit_factor(unit, target):
+    if unit == target:
+        return 1
+    source, target = UNIT_SCALES.get(unit), UNIT_SCALES.get(target)
+    if source is None or target is None or source[0] != target[0]:
+        return None
+    return source[1] / target[1]
+
+
+def expected_portions(db, today):
+    since, _ = day_range(today - timedelta(days=PLANNER_ATTENDANCE_DAYS))
+    row = db.execute('''
+        SELECT SUM(meals_breakfast) AS breakfast, SUM(meals_breakfast > 0) AS breakfast_days,
+               SUM(meals_lunch) AS lunch, SUM(meals_lunch > 0) AS lunch_days
+        FROM daily_stats
+        WHERE day >= ?
+    ''', (since,)).fetchone()
+    students = len(get_role_user_ids(db, 'student'))
+    return {meal_type: row[meal_type] / row[f'{meal_type}_days'] if row[f'{meal_type}_days'] else students
+            for meal_type in ('breakfast', 'lunch')}
+
+
+def plan_demand(db, start, days):
+    catalog = get_catalog(db)
+    dish_index, ingredients, units, recipe_matrix = catalog.recipe_matrix()
+    expected = expected_portions(db, date.today())
+
+    portions = np.zeros((days, len(dish_index)))
+    menu_days = 0
+    for offset in range(days):
+        menu = catalog.menu_for(start + timedelta(days=offset))
+        if not menu:
+            continue
+        menu_days += 1
+        for meal_type, count in expected.items():
+            for dish in meal_dishes(menu, meal_type):
+                if dish in dish_index:
+                    portions[offset, dish_index[dish]] += count
+
+    stock_rows = {row['product_name']: row for row in db.execute('SELECT product_name, unit, quantity FROM inventory_stock')}
+    stock = np.array([max(stock_rows[name]['quantity'], 0) if name in stock_rows else 0 for name in ingredients])
+    # Потребность считаем в единицах склада: заявка на закупку принимает только их.
+    stock_units = [stock_rows[name]['unit'] if name in stock_rows else unit for name, unit in zip(ingredients, units)]
+    factors = [unit_factor(unit, stock_unit) for unit, stock_unit in zip(units, stock_units)]
+    comparable = np.array([factor is not None for factor in factors])
+    cumulative = np.cumsum(portions @ recipe_matrix, axis=0) * np.array([factor or 1 for factor in factors])
+    demand = cumulative[-1]
+    shortfall = np.where(comparable, np.maximum(np.ceil((demand - stock) * 100 - 1e-6), 0) / 100, 0)
+    short = (cumulative > stock + 1e-9) & comparable
+    runs_out = np.where(short.any(axis=0), short.argmax(axis=0), -1)
+
+    rows = []
+    for i in np.argsort(-shortfall, kind='stable'):
+        if not demand[i]:
+            continue
+        rows.append({
+            'ingredient': ingredients[i],
+            'unit': stock_units[i] if comparable[i] else units[i],
+            'stock_unit': stock_units[i],
+            'comparable': bool(comparable[i]),
+            'demand': float(demand[i]),
+            'stock': float(stock[i]),
+            'shortfall': float(shortfall[i]),
+            'runs_out': start + timedelta(days=int(runs_out[i])) if runs_out[i] >= 0 else None,
+        })
+    return {'start': start, 'end': start + timedelta(days=days - 1), 'menu_days': menu_days,
+            'expected': expected, 'rows': rows}
+
+
+class ProductionError(Exception):
+    pass
+
+
+def prepare_order(db, order):
+    portions = {}
+    for dish, quantity in order:
+        portions[dish] = portions.get(dish, 0) + quantity
+    if not portions:
+        raise ProductionError('Заказ пуст')
+
+    catalog = get_catalog(db)
+    for dish in portions:
+        if dish not in catalog.prices:
+            raise ProductionError(f'Блюдо "{dish}" не найдено')
+
+    demand = {}
+    for dish, quantity in portions.items():
+        for ing in catalog.recipes.get(dish, []):
+            demand[ing['ingredient']] = demand.get(ing['ingredient'], 0) + ing['quantity'] * quantity
+    demand = {ingredient: round(needed, 2) for ingredient, needed in demand.items()}
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if demand:
+            placeholders = ', '.join('?' * len(demand))
+            stock = dict(db.execute(
+                f'SELECT product_name, quantity FROM inventory_stock WHERE product_name IN ({placeholders})',
+                list(demand)).fetchall())
+            for ingredient, needed in demand.items():
+                if not stock.get(ingredient):
+                    raise ProductionError(f'Ингредиент "{ingredient}" отсутствует на складе')
+                if stock[ingredient] < needed:
+                    raise ProductionError(f'Не хватает "{ingredient}": нужно {needed:g}, на складе {stock[ingredient]:g}')
+
+        last_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM prepared_dishes').fetchone()[0]
+        db.executemany('INSERT INTO prepared_dishes (dish_name, quantity) VALUES (?, ?)', list(portions.items()))
+        movements = []
+        for row in db.execute('SELECT id, dish_name FROM prepared_dishes WHERE id > ? ORDER BY id', (last_id,)):
+            quantity = portions[row['dish_name']]
+            movements.extend((ing['ingredient'], -round(ing['quantity'] * quantity, 2), 'prepare',
+                              f'prepared_dishes:{row["id"]}')
+                             for ing in catalog.recipes.get(row['dish_name'], []))
+        db.executemany('''
+            INSERT INTO inventory_movements (product_name, delta, kind, source)
+            VALUES (?, ?, ?, ?)
+        ''', movements)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return portions
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def meal_demand(catalog, dishes):
+    demand = {}
+    for dish in dishes:
+        for ing in catalog.recipes.get(dish, []):
+            entry = demand.setdefault(ing['ingredient'], {'needed': 0, 'dish': dish})
+            entry['needed'] += ing['quantity']
+    return demand
+
+
+def checkout_meal(db, student_id, student_name, meal_type, today=None):
+    today = today or date.today()
+    day_start, day_end = day_range(today)
+    catalog = get_catalog(db)
+    menu_set = catalog.menu_for(today)
+    cook_ids = get_role_user_ids(db, 'cook')
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        existing = db.execute('''
+            SELECT 1 FROM meal_records
+            WHERE student_id = ? AND meal_type = ? AND taken_at >= ? AND taken_at < ?
+        ''', (student_id, meal_type, day_start, day_end)).fetchone()
+        if existing:
+            raise CheckoutError(f'Вы уже получили {meal_type} сегодня!')
+
+        if not menu_set:
+            raise CheckoutError('Меню на сегодня не составлено')
+
+        dishes = meal_dishes(menu_set, meal_type)
+        demand = meal_demand(catalog, dishes)
+
+        if demand:
+            placeholders = ', '.join('?' * len(demand))
+            stock = dict(db.execute(
+                f'SELECT product_name, quantity FROM inventory_stock WHERE product_name IN ({placeholders})',
+                list(demand)).fetchall())
+            demand = {name: entry for name, entry in demand.items() if name in stock}
+            for ingredient, entry in demand.items():
+                if stock[ingredient] < entry['needed']:
+                    raise CheckoutError(f'Не хватает "{ingredient}" для "{entry["dish"]}"')
+
+        has_sub = db.execute('''
+            SELECT 1 FROM subscriptions
+            WHERE student_id = ? AND status = 'active' AND end_date >= ? AND start_date <= ?
+        ''', (student_id, today, today)).fetchone() is not None
+
+        total_price = 0
+        if not has_sub:
+            for dish in dishes:
+                if dish not in catalog.prices:
+                    raise CheckoutError(f'Блюдо "{dish}" не найдено')
+                total_price += catalog.prices[dish]
+
+            charged = db.execute('''
+                UPDATE student_profiles SET balance = balance - ?
+                WHERE user_id = ? AND balance >= ?
+            ''', (total_price, student_id, total_price)).rowcount
+            if not charged:
+                profile = db.execute('SELECT balance FROM student_profiles WHERE user_id = ?',
+                                     (student_id,)).fetchone()
+                current = profile['balance'] if profile else 0
+                raise CheckoutError(f'Недостаточно средств. Нужно: {total_price} ₽, у вас: {current} ₽')
+            db.execute('''
+                INSERT INTO payments (student_id, amount, payment_type, description)
+                VALUES (?, ?, 'one-time', ?)
+            ''', (student_id, total_price, f'Оплата за {meal_type}'))
+
+        record_id = db.execute('INSERT INTO meal_records (student_id, menu_id, meal_type) VALUES (?, ?, ?)',
+                               (student_id, menu_set['id'], meal_type)).lastrowid
+        record_movements(db, 'consume', f'meal_records:{record_id}',
+                         [(ingredient, -entry['needed']) for ingredient, entry in demand.items()])
+
+        if has_sub:
+            cook_message = f'Ученик {student_name} получил {meal_type} по абонементу.'
+        else:
+            cook_message = f'Ученик {student_name} получил {meal_type}. Списано: {total_price} ₽.'
+        stage_notifications(db, [(student_id, f'Вы получили {meal_type}!')] +
+                            [(cook_id, cook_message) for cook_id in cook_ids])
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return total_price, has_sub
+
+
+def parse_student_queue(text):
+    student_ids = []
+    for token in re.split(r'[\s,;]+', text.strip()):
+        if not token:
+            continue
+        if not token.isdigit():
+            raise CheckoutError(f'Неверный номер ученика: "{token}"')
+        student_ids.append(int(token))
+    if not student_ids:
+        raise CheckoutError('Очередь пуста')
+    if len(student_ids) > SERVING_QUEUE_LIMIT:
+        raise CheckoutError(f'За один раз можно выдать не больше {SERVING_QUEUE_LIMIT} порций')
+    return student_ids
+
+
+def issue_meals(db, student_ids, meal_type, today=None):
+    today = today or date.today()
+    day_start, day_end = day_range(today)
+    catalog = get_catalog(db)
+    menu_set = catalog.menu_for(today)
+    if not menu_set:
+        raise CheckoutError('Меню на сегодня не составлено')
+    dishes = meal_dishes(menu_set, meal_type)
+    demand = meal_demand(catalog, dishes)
+    missing_dish = next((dish for dish in dishes if dish not in catalog.prices), None)
+    price = sum(catalog.prices.get(dish, 0) for dish in dishes)
+    cook_ids = get_role_user_ids(db, 'cook')
+
+    results = []
+    issued_total = charged_total = 0
+    for offset in range(0, len(student_ids), SERVING_BATCH_SIZE):
+        chunk = student_ids[offset:offset + SERVING_BATCH_SIZE]
+        ids = sorted(set(chunk))
+        placeholders = ', '.join('?' * len(ids))
+        confirmations = []
+        charges = []
+        served = []
+        chunk_results = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            students = {row['id']: dict(row) for row in db.execute(f'''
+                SELECT u.id, u.full_name, COALESCE(sp.balance, 0) AS balance
+                FROM users u
+                LEFT JOIN student_profiles sp ON sp.user_id = u.id
+                WHERE u.role = 'student' AND u.id IN ({placeholders})
+            ''', ids)}
+            records = {row['student_id']: dict(row) for row in db.execute(f'''
+                SELECT id, student_id, confirmed FROM meal_records
+                WHERE student_id IN ({placeholders}) AND meal_type = ? AND taken_at >= ? AND taken_at < ?
+            ''', ids + [meal_type, day_start, day_end])}
+            subscribed = {row[0] for row in db.execute(f'''
+                SELECT student_id FROM subscriptions
+                WHERE student_id IN ({placeholders}) AND status = 'active' AND end_date >= ? AND start_date <= ?
+            ''', ids + [today, today])}
+            stock = {}
+            if demand:
+                stock = dict(db.execute(
+                    f'SELECT product_name, quantity FROM inventory_stock '
+                    f'WHERE product_name IN ({", ".join("?" * len(demand))})', list(demand)).fetchall())
+            needed = {name: entry for name, entry in demand.items() if name in stock}
+
+            for student_id in chunk:
+                student = students.get(student_id)
+                result = {'student_id': student_id, 'full_name': student['full_name'] if student else None,
+                          'status': 'failed', 'charged': 0}
+                chunk_results.append(result)
+                if not student:
+                    result['message'] = 'Ученик не найден'
+                    continue
+                record = records.get(student_id)
+                if record and not record['confirmed']:
+                    confirmations.append((record['id'],))
+                    record['confirmed'] = 1
+                    result.update(status='confirmed', message='Выдача подтверждена')
+                    continue
+                if record:
+                    result['message'] = f'Уже получил {meal_type} сегодня'
+                    continue
+                short = next((name for name, entry in needed.items() if stock[name] < entry['needed']), None)
+                if short:
+                    result['message'] = f'Не хватает "{short}" для "{needed[short]["dish"]}"'
+                    continue
+                has_sub = student_id in subscribed
+                if not has_sub:
+                    if missing_dish:
+                        result['message'] = f'Блюдо "{missing_dish}" не найдено'
+                        continue
+                    if student['balance'] < price:
+                        result['message'] = f'Недостаточно средств. Нужно: {price} ₽, на счёте: {student["balance"]} ₽'
+                        continue
+                    student['balance'] -= price
+                    charges.append(student_id)
+                    result['charged'] = price
+                for name, entry in needed.items():
+                    stock[name] -= entry['needed']
+                records[student_id] = {'id': None, 'confirmed': 1}
+                served.append(student_id)
+                result.update(status='issued', message='По абонементу' if has_sub else f'Списано: {price} ₽')
+
+            db.executemany('UPDATE meal_records SET confirmed = 1 WHERE id = ?', confirmations)
+            db.executemany('UPDATE student_profiles SET balance = balance - ? WHERE user_id = ?',
+                           [(price, student_id) for student_id in charges])
+            db.executemany('''
+                INSERT INTO payments (student_id, amount, payment_type, description)
+                VALUES (?, ?, 'one-time', ?)
+            ''', [(student_id, price, f'Оплата за {meal_type}') for student_id in charges])
+            last_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM meal_records').fetchone()[0]
+            db.executemany('INSERT INTO meal_records (student_id, menu_id, meal_type, confirmed) VALUES (?, ?, ?, 1)',
+                           [(student_id, menu_set['id'], meal_type) for student_id in served])
+            movements = []
+            for row in db.execute('SELECT id FROM meal_records WHERE id > ? ORDER BY id', (last_id,)):
+                movements.extend((name, -entry['needed'], 'consume', f'meal_records:{row["id"]}')
+                                 for name, entry in needed.items())
+            db.executemany('''
+                INSERT INTO inventory_movements (product_name, delta, kind, source)
+                VALUES (?, ?, ?, ?)
+            ''', movements)
+            stage_notifications(db, [(student_id, f'Вы получили {meal_type}!') for student_id in served])
+
+            db.commit()
+        except (sqlite3.Error, CheckoutError) as e:
+            if db.in_transaction:
+                db.rollback()
+            # Предыдущие группы уже записаны: не теряем их результаты, а отмечаем эту группу целиком.
+            app.logger.exception('Не удалось выдать питание группе из %d учеников', len(chunk))
+            message = str(e) if isinstance(e, CheckoutError) else 'Не записано из-за ошибки базы данных, повторите'
+            failed = {'status': 'failed', 'charged': 0, 'message': message}
+            chunk_results = [dict(result, **failed) for result in chunk_results] + \
+                [dict(student_id=student_id, full_name=None, **failed) for student_id in chunk[len(chunk_results):]]
+            served, charges = [], []
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+
+        results.extend(chunk_results)
+        issued_total += len(served)
+        charged_total += price * len(charges)
+
+    if issued_total:
+        try:
+            stage_notifications(db, [(cook_id, f'На раздаче выдано {meal_type}: {issued_total}. '
+                                               f'Списано: {charged_total} ₽.') for cook_id in cook_ids])
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            app.logger.exception('Не удалось отправить поварам итог раздачи')
+    return results
+
+
+_static_fingerprints = {}
+
+
+def static_fingerprint(filename):
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _static_fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        fingerprint = hashlib.sha256(f.read()).hexdigest()[:12]
+    _static_fingerprints[path] = (mtime, fingerprint)
+    return fingerprint
+
+
+@app.url_defaults
+def add_static_fingerprint(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        fingerprint = static_fingerprint(values.get('filename', ''))
+        if fingerprint:
+            values['v'] = fingerprint
+
+
+@app.after_request
+def cache_fingerprinted_static(response):
+    if request.endpoint == 'static' and response.status_code == 200 and request.args.get('v') and \
+            request.args['v'] == static_fingerprint(request.view_args.get('filename', '')):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def conditional_page(render, version):
+    # Только ETag: в версию страниц входят счётчик непрочитанных и отметки о питании,
+    # которые дата изменения не отражает, поэтому Last-Modified/If-Modified-Since не используем.
+    if '_flashes' in session:
+        return render()
+    etag = hashlib.sha256(repr((request.path, session.get('user_id'), version)).encode()).hexdigest()[:32]
+    not_modified = request.if_none_match.contains(etag)
+    response = Response(status=304) if not_modified else make_response(render())
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+_menu_fragments = {}
+_menu_overlays = {}
+_menu_slot = re.compile(r'<!--(flags|action):(.*?)-->')
+
+
+def menu_fragment(catalog, menu_set, day):
+    key = (str(day), catalog.version)
+    cached = _menu_fragments.get(DATABASE)
+    if cached and cached[0] == key:
+        return cached[1]
+    fragment = render_template('student/menu_meals.html', menu_set=menu_set,
+                               breakfast_price=menu_set['breakfast_price'], lunch_price=menu_set['lunch_price'])
+    _menu_fragments[DATABASE] = (key, fragment)
+    return fragment
+
+
+def menu_overlay(macro, *args):
+    key = (macro,) + args
+    overlay = _menu_overlays.get(key)
+    if overlay is None:
+        overlay = _menu_overlays[key] = str(get_template_attribute('student/menu_overlays.html', macro)(*args))
+    return overlay
+
+
+def render_menu_meals(catalog, menu_set, day, taken_types, allergen_warnings, preference_matches):
+    def apply_overlay(match):
+        kind, name = match.groups()
+        if kind == 'action':
+            return menu_overlay('meal_action', name, name in taken_types)
+        dish = Markup(name).unescape()
+        return menu_overlay('dish_flags', dish in allergen_warnings, dish in preference_matches)
+
+    return Markup(_menu_slot.sub(apply_overlay, menu_fragment(catalog, menu_set, day)))
+
+def authenticate(db, full_name, password):
+    user = db.execute('SELECT * FROM users WHERE full_name = ?', (full_name,)).fetchone()
+    verifier = get_password_verifier()
+    valid = user is not None and verifier.verify(user['password_hash'], password)
+    if valid and needs_rehash(user['password_hash']):
+        db.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                   (verifier.run(hash_password, password), user['id'], user['password_hash']))
+        db.commit()
+    return user if valid else None
+
+
+def taken_meal_types(db, student_id, day):
+    day_start, day_end = day_range(day)
+    rows = db.execute('''
+        SELECT meal_type FROM meal_records 
+        WHERE student_id = ? AND taken_at >= ? AND taken_at < ?
+    ''', (student_id, day_start, day_end)).fetchall()
+    return {row['meal_type'] for row in rows}
 
 
 @app.route('/')
@@ -298,9 +2232,12 @@ def login():
     if request.method == 'POST':
         full_name = request.form['full_name']
         password = request.form['password']
-        db = get_db()
-        user = db.execute('SELECT * FROM users WHERE full_name = ?', (full_name,)).fetchone()
-        if user and check_password_hash(user['password_hash'], password):
+        try:
+            user = authenticate(get_db(), full_name, password)
+        except VerifierOverloaded:
+            flash('Слишком много входов одновременно, попробуйте через несколько секунд')
+            return render_template('login.html'), 503
+        if user:
             session['user_id'] = user['id']
             session['role'] = user['role']
             session['full_name'] = user['full_name']
@@ -321,7 +2258,7 @@ def register():
         db = get_db()
         try:
             db.execute('INSERT INTO users (full_name, password_hash, role) VALUES (?, ?, ?)',
-                       (full_name, generate_password_hash(password), role))
+                       (full_name, hash_password(password), role))
             user_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
             db.execute('INSERT INTO student_profiles (user_id, balance) VALUES (?, 0.0)', (user_id,))
             db.commit()
@@ -352,79 +2289,39 @@ def student_menu():
     db = get_db()
     unread_count = get_unread_notifications_count(session['user_id'], db)
     today = date.today()
-    menu_set = db.execute('SELECT * FROM menu_sets WHERE meal_date = ?', (today,)).fetchone()
-    taken_meals = db.execute('''
-        SELECT meal_type FROM meal_records 
-        WHERE student_id = ? AND date(taken_at) = ?
-    ''', (session['user_id'], today)).fetchall()
-    taken_types = {row['meal_type'] for row in taken_meals}
+    catalog = get_catalog(db)
+    menu_set = catalog.menu_for(today)
+    taken_types = taken_meal_types(db, session['user_id'], today)
 
-
-    breakfast_price = 0.0
-    lunch_price = 0.0
-    if menu_set:
-
-        breakfast_items = [menu_set['breakfast_main'], menu_set['breakfast_drink']]
-        prices = db.execute('''
-            SELECT price FROM dishes WHERE name IN (?, ?)
-        ''', (menu_set['breakfast_main'], menu_set['breakfast_drink'])).fetchall()
-        breakfast_price = sum(p['price'] for p in prices)
-
-        lunch_items = [menu_set['lunch_first'], menu_set['lunch_second'], menu_set['lunch_drink']]
-        prices = db.execute('''
-            SELECT price FROM dishes WHERE name IN (?, ?, ?)
-        ''', (menu_set['lunch_first'], menu_set['lunch_second'], menu_set['lunch_drink'])).fetchall()
-        lunch_price = sum(p['price'] for p in prices)
-
-    profile = db.execute('SELECT allergies, preferences FROM student_profiles WHERE user_id = ?',
+    profile = db.execute('SELECT allergy_mask, preference_mask FROM student_profiles WHERE user_id = ?',
                          (session['user_id'],)).fetchone()
-
-    allergies = set()
-    if profile and profile['allergies']:
-        allergies = {a.strip().lower() for a in profile['allergies'].split(',') if a.strip()}
-
-    preferences = set()
-    if profile and profile['preferences']:
-        preferences = {p.strip().lower() for p in profile['preferences'].split(',') if p.strip()}
-
-    allergen_warnings = {}
-    preference_matches = {}
-
-    if menu_set:
-        all_dishes = [
-            menu_set['breakfast_main'],
-            menu_set['breakfast_drink'],
-            menu_set['lunch_first'],
-            menu_set['lunch_second'],
-            menu_set['lunch_drink']
-        ]
-        for dish_name in all_dishes:
-            if not dish_name:
-                continue
-            ingredients = db.execute('''
-                SELECT ingredient FROM dish_recipes WHERE dish_name = ?
-            ''', (dish_name,)).fetchall()
-            dish_ingredients = {ing['ingredient'].lower() for ing in ingredients}
-
-            if allergies & dish_ingredients:
-                allergen_warnings[dish_name] = True
-
-            if preferences & dish_ingredients:
-                preference_matches[dish_name] = True
-
-    return render_template(
-        'student/menu.html',
-        menu_set=menu_set,
-        today=today,
-        taken_types=taken_types,
-        allergen_warnings=allergen_warnings,
-        preference_matches=preference_matches,
-        allergies_list=', '.join(allergies) if allergies else None,
-        preferences_list=', '.join(preferences) if preferences else None,
-        breakfast_price=breakfast_price,
-        lunch_price=lunch_price,
-        unread_count=unread_count
-    )
+    allergy_mask = int(profile['allergy_mask'] or '0', 16) if profile else 0
+    preference_mask = int(profile['preference_mask'] or '0', 16) if profile else 0
+
+    allergen_warnings, preference_matches = catalog.menu_flags([menu_set] if menu_set else [],
+                                                               allergy_mask, preference_mask)
+    allergies = catalog.mask_names(allergy_mask, db)
+    preferences = catalog.mask_names(preference_mask, db)
+
+    def render():
+        meals_html = None
+        if menu_set:
+            meals_html = render_menu_meals(catalog, menu_set, today, taken_types,
+                                           allergen_warnings, preference_matches)
+        return render_template(
+            'student/menu.html',
+            menu_set=menu_set,
+            meals_html=meals_html,
+            today=today,
+            allergen_warnings=allergen_warnings,
+            preference_matches=preference_matches,
+            allergies_list=', '.join(allergies) if allergies else None,
+            preferences_list=', '.join(preferences) if preferences else None,
+            unread_count=unread_count
+        )
+
+    version = (catalog.version, today, sorted(taken_types), allergy_mask, preference_mask, unread_count)
+    return conditional_page(render, version)
 
 
 @app.route('/student/get_meal/<meal_type>')
@@ -437,88 +2334,12 @@ def student_get_meal(meal_type):
         return redirect(url_for('student_menu'))
 
     db = get_db()
-    unread_count = get_unread_notifications_count(session['user_id'], db)
-    today = date.today()
-
-    existing = db.execute('''
-        SELECT 1 FROM meal_records 
-        WHERE student_id = ? AND meal_type = ? AND date(taken_at) = ?
-    ''', (session['user_id'], meal_type, today)).fetchone()
-
-    if existing:
-        flash(f'Вы уже получили {meal_type} сегодня!')
-        return redirect(url_for('student_menu'))
-
-    menu_set = db.execute('SELECT * FROM menu_sets WHERE meal_date = ?', (today,)).fetchone()
-    if not menu_set:
-        flash('Меню на сегодня не составлено')
+    try:
+        checkout_meal(db, session['user_id'], session['full_name'], meal_type)
+    except CheckoutError as e:
+        flash(str(e))
         return redirect(url_for('student_menu'))
 
-    if meal_type == 'breakfast':
-        dishes = [menu_set['breakfast_main'], menu_set['breakfast_drink']]
-    else:
-        dishes = [menu_set['lunch_first'], menu_set['lunch_second'], menu_set['lunch_drink']]
-
-    for dish in dishes:
-        ingredients = db.execute('''
-            SELECT dr.ingredient, dr.quantity, i.quantity as stock
-            FROM dish_recipes dr
-            JOIN inventory i ON dr.ingredient = i.product_name
-            WHERE dr.dish_name = ?
-        ''', (dish,)).fetchall()
-        for ing in ingredients:
-            if ing['stock'] < ing['quantity']:
-                flash(f'Не хватает "{ing["ingredient"]}" для "{dish}"')
-                return redirect(url_for('student_menu'))
-
-    has_sub = db.execute('''
-        SELECT 1 FROM subscriptions 
-        WHERE student_id = ? AND status = 'active' AND ? BETWEEN start_date AND end_date
-    ''', (session['user_id'], today)).fetchone()
-
-    total_price = 0
-    if not has_sub:
-        for dish in dishes:
-            price_row = db.execute('SELECT price FROM dishes WHERE name = ?', (dish,)).fetchone()
-            if not price_row:
-                flash(f'Блюдо "{dish}" не найдено')
-                return redirect(url_for('student_menu'))
-            total_price += price_row['price']
-
-        profile = db.execute('SELECT balance FROM student_profiles WHERE user_id = ?', (session['user_id'],)).fetchone()
-        if not profile or profile['balance'] < total_price:
-            current = profile['balance'] if profile else 0
-            flash(f'Недостаточно средств. Нужно: {total_price} ₽, у вас: {current} ₽')
-            return redirect(url_for('student_menu'))
-
-    for dish in dishes:
-        ingredients = db.execute('SELECT ingredient, quantity FROM dish_recipes WHERE dish_name = ?',
-                                 (dish,)).fetchall()
-        for ing in ingredients:
-            db.execute('UPDATE inventory SET quantity = quantity - ? WHERE product_name = ?',
-                       (ing['quantity'], ing['ingredient']))
-
-    if not has_sub:
-        db.execute('UPDATE student_profiles SET balance = balance - ? WHERE user_id = ?',
-                   (total_price, session['user_id']))
-        db.execute('INSERT INTO payments (student_id, amount, payment_type, description) VALUES (?, ?, "one-time", ?)',
-                   (session['user_id'], total_price, f'Оплата за {meal_type}'))
-
-    db.execute('INSERT INTO meal_records (student_id, menu_id, meal_type) VALUES (?, ?, ?)',
-               (session['user_id'], menu_set['id'], meal_type))
-    db.commit()
-
-
-    send_notification(session['user_id'], f'Вы получили {meal_type}!')
-
-    cook_id = db.execute("SELECT id FROM users WHERE role = 'cook' LIMIT 1").fetchone()
-    if cook_id:
-        if has_sub:
-            send_notification(cook_id['id'], f'Ученик {session["full_name"]} получил {meal_type} по абонементу.')
-        else:
-            send_notification(cook_id['id'],
-                              f'Ученик {session["full_name"]} получил {meal_type}. Списано: {total_price} ₽.')
-
     flash(f'Вы получили {meal_type}!')
     return redirect(url_for('student_menu'))
 
@@ -589,7 +2410,7 @@ def student_payment():
         ''', (session['user_id'], duration, start_from, new_end_date))
 
 
-        send_notification(session['user_id'], f'Абонемент активирован до {new_end_date}!')
+        send_notification(db, session['user_id'], f'Абонемент активирован до {new_end_date}!')
 
         db.commit()
         flash(f'Абонемент продлён до {new_end_date}!')
@@ -639,7 +2460,7 @@ def student_card_topup():
         card_digits = re.sub(r'\D', '', card_number)
         if not card_digits:
             card_digits = '0000000000000000'
-        encrypted_card = fernet.encrypt(card_digits.encode()).decode()
+        encrypted_card = get_fernet().encrypt(card_digits.encode()).decode()
 
         db = get_db()
         unread_count = get_unread_notifications_count(session['user_id'], db)
@@ -675,6 +2496,7 @@ def student_profile():
         prefs = request.form.get('preferences', '')
         db.execute('UPDATE student_profiles SET allergies = ?, preferences = ? WHERE user_id = ?',
                    (allergies, prefs, session['user_id']))
+        update_student_masks(db, session['user_id'], allergies, prefs)
         db.commit()
         flash('Данные сохранены')
     profile = db.execute('SELECT * FROM student_profiles WHERE user_id = ?', (session['user_id'],)).fetchone()
@@ -693,16 +2515,10 @@ def student_reviews():
         comment = request.form.get('comment', '')
         db.execute('INSERT INTO reviews (student_id, dish_name, rating, comment) VALUES (?, ?, ?, ?)',
                    (session['user_id'], dish, rating, comment))
+        notify_role(db, 'admin', f'Новый отзыв от {session["full_name"]} о блюде "{dish}"')
+        notify_role(db, 'cook', f'Новый отзыв от {session["full_name"]} о блюде "{dish}": {rating} ⭐')
         db.commit()
 
-        admin_id = db.execute("SELECT id FROM users WHERE role = 'admin' LIMIT 1").fetchone()
-        cook_id = db.execute("SELECT id FROM users WHERE role = 'cook' LIMIT 1").fetchone()
-
-        if admin_id:
-            send_notification(admin_id['id'], f'Новый отзыв от {session["full_name"]} о блюде "{dish}"')
-        if cook_id:
-            send_notification(cook_id['id'], f'Новый отзыв от {session["full_name"]} о блюде "{dish}": {rating} ⭐')
-
         flash('Отзыв отправлен')
     reviews = db.execute('SELECT * FROM reviews WHERE student_id = ?', (session['user_id'],)).fetchall()
     return render_template('student/reviews.html', reviews=reviews, unread_count=unread_count)
@@ -719,7 +2535,7 @@ def cook_dashboard():
         FROM meal_records mr
         JOIN users u ON mr.student_id = u.id
         JOIN menu_sets ms ON mr.menu_id = ms.id
-        WHERE date(mr.taken_at) = date('now')
+        WHERE mr.taken_at >= date('now') AND mr.taken_at < date('now', '+1 day')
         ORDER BY mr.taken_at DESC
     ''').fetchall()
     return render_template('cook/dashboard.html', records=records, unread_count=unread_count)
@@ -736,6 +2552,28 @@ def cook_confirm_meal(record_id):
     return redirect(url_for('cook_dashboard'))
 
 
+@app.route('/cook/serve', methods=['GET', 'POST'])
+def cook_serve():
+    if session.get('role') != 'cook':
+        return redirect(url_for('login'))
+    db = get_db()
+    unread_count = get_unread_notifications_count(session['user_id'], db)
+
+    meal_type = request.form.get('meal_type', 'lunch')
+    results = None
+    if request.method == 'POST':
+        if meal_type not in ('breakfast', 'lunch'):
+            flash('Неверный тип питания')
+            return redirect(url_for('cook_serve'))
+        try:
+            results = issue_meals(db, parse_student_queue(request.form.get('students', '')), meal_type)
+        except CheckoutError as e:
+            flash(str(e))
+            return redirect(url_for('cook_serve'))
+
+    return render_template('cook/serve.html', meal_type=meal_type, results=results, unread_count=unread_count)
+
+
 @app.route('/cook/inventory', methods=['GET', 'POST'])
 def cook_inventory():
     if session.get('role') != 'cook':
@@ -743,20 +2581,49 @@ def cook_inventory():
     db = get_db()
     unread_count = get_unread_notifications_count(session['user_id'], db)
     if request.method == 'POST':
-        items = request.form['items']
-        db.execute('INSERT INTO purchase_requests (cook_id, items) VALUES (?, ?)',
-                   (session['user_id'], items))
-        db.commit()
+        lines = zip(request.form.getlist('product'), request.form.getlist('quantity'), request.form.getlist('unit'))
+        try:
+            create_purchase_request(db, session['user_id'], session['full_name'], lines)
+        except PurchaseRequestError as e:
+            flash(str(e))
+        else:
+            flash('Заявка отправлена администратору')
+    stock_date = None
+    try:
+        stock_date = date.fromisoformat(request.args.get('on', ''))
+    except ValueError:
+        pass
+    inventory = stock_on(db, stock_date) if stock_date else None
+    no_snapshot = stock_date is not None and inventory is None
+    if inventory is None:
+        inventory = db.execute('SELECT * FROM inventory_stock ORDER BY product_name').fetchall()
+    requests = db.execute('SELECT * FROM purchase_requests WHERE cook_id = ?', (session['user_id'],)).fetchall()
+    return render_template('cook/inventory.html', inventory=inventory, requests=requests, stock_date=stock_date,
+                           no_snapshot=no_snapshot, unread_count=unread_count)
 
 
-        admin_id = db.execute("SELECT id FROM users WHERE role = 'admin' LIMIT 1").fetchone()
-        if admin_id:
-            send_notification(admin_id['id'], f'Новая заявка от повара {session["full_name"]}')
+@app.route('/cook/planner')
+def cook_planner():
+    if session.get('role') != 'cook':
+        return redirect(url_for('login'))
+    db = get_db()
+    unread_count = get_unread_notifications_count(session['user_id'], db)
 
-        flash('Заявка отправлена администратору')
-    inventory = db.execute('SELECT * FROM inventory ORDER BY product_name').fetchall()
-    requests = db.execute('SELECT * FROM purchase_requests WHERE cook_id = ?', (session['user_id'],)).fetchall()
-    return render_template('cook/inventory.html', inventory=inventory, requests=requests, unread_count=unread_count)
+    try:
+        start = date.fromisoformat(request.args.get('start', ''))
+    except ValueError:
+        start = date.today()
+    try:
+        days = int(request.args.get('days', PLANNER_DEFAULT_DAYS))
+    except ValueError:
+        days = PLANNER_DEFAULT_DAYS
+    days = min(max(days, 1), PLANNER_MAX_DAYS)
+
+    plan = plan_demand(db, start, days)
+    shortfall = [row for row in plan['rows'] if row['shortfall'] > 0]
+    mismatched = [row for row in plan['rows'] if not row['comparable']]
+    return render_template('cook/planner.html', plan=plan, days=days, shortfall=shortfall, mismatched=mismatched,
+                           max_days=PLANNER_MAX_DAYS, unread_count=unread_count)
 
 
 @app.route('/cook/prepare', methods=['GET'])
@@ -767,46 +2634,14 @@ def cook_prepare():
     unread_count = get_unread_notifications_count(session['user_id'], db)
     search = request.args.get('search', '').strip()
 
-    if search:
-        dishes = db.execute('''
-            SELECT name, price FROM dishes 
-            WHERE name LIKE ?
-            ORDER BY name
-        ''', (f'%{search}%',)).fetchall()
-    else:
-        dishes = db.execute('SELECT name, price FROM dishes ORDER BY name').fetchall()
+    catalog = get_catalog(db)
+    dishes = catalog.search(search) if search else catalog.dishes
+    stock = dict(db.execute('SELECT product_name, quantity FROM inventory_stock').fetchall())
 
-    recipes = {}
-    available = {}
+    recipes = {dish['name']: catalog.recipes.get(dish['name'], []) for dish in dishes}
+    capacity = cookable_portions(catalog, stock, recipes)
 
-    for dish in dishes:
-        rows = db.execute('''
-            SELECT ingredient, quantity, unit 
-            FROM dish_recipes 
-            WHERE dish_name = ?
-        ''', (dish['name'],)).fetchall()
-
-        unique_ings = {}
-        for row in rows:
-            ing = row['ingredient']
-            if ing not in unique_ings:
-                unique_ings[ing] = {
-                    'ingredient': ing,
-                    'quantity': row['quantity'],
-                    'unit': row['unit']
-                }
-        recipes[dish['name']] = list(unique_ings.values())
-
-        can_cook = True
-        for ing in unique_ings.values():
-            stock_row = db.execute('SELECT quantity FROM inventory WHERE product_name = ?',
-                                   (ing['ingredient'],)).fetchone()
-            if not stock_row or stock_row['quantity'] < ing['quantity']:
-                can_cook = False
-                break
-        available[dish['name']] = can_cook
-
-    return render_template('cook/prepare.html', dishes=dishes, recipes=recipes, available=available, search=search,
+    return render_template('cook/prepare.html', dishes=dishes, recipes=recipes, capacity=capacity, search=search,
                            unread_count=unread_count)
 
 
@@ -827,43 +2662,42 @@ def cook_prepare_dish(dish_name):
     except (ValueError, TypeError):
         quantity = 1
 
-    dish = db.execute('SELECT 1 FROM dishes WHERE name = ?', (dish_name,)).fetchone()
-    if not dish:
-        flash('Блюдо не найдено')
+    try:
+        prepare_order(db, [(dish_name, quantity)])
+    except ProductionError as e:
+        flash(str(e))
         return redirect(url_for('cook_prepare'))
 
-    ingredients = db.execute('''
-        SELECT dr.ingredient, dr.quantity, i.quantity as stock
-        FROM dish_recipes dr
-        LEFT JOIN inventory i ON dr.ingredient = i.product_name
-        WHERE dr.dish_name = ?
-    ''', (dish_name,)).fetchall()
+    flash(f'Приготовлено {quantity} порций "{dish_name}"!')
+    return redirect(url_for('cook_prepared'))
 
-    for ing in ingredients:
-        if not ing['stock'] or ing['stock'] is None:
-            flash(f'Ингредиент "{ing["ingredient"]}" отсутствует на складе')
-            return redirect(url_for('cook_prepare'))
-        needed = round(ing['quantity'] * quantity, 2)
-        if ing['stock'] < needed:
-            flash(f'Не хватает "{ing["ingredient"]}" для {quantity} порций "{dish_name}"')
-            return redirect(url_for('cook_prepare'))
 
-    for ing in ingredients:
-        needed = round(ing['quantity'] * quantity, 2)
-        current = db.execute('SELECT quantity FROM inventory WHERE product_name = ?', (ing['ingredient'],)).fetchone()
-        if not current or current['quantity'] < needed:
-            flash('Ошибка: недостаточно ингредиентов (состояние склада изменилось)')
+@app.route('/cook/prepare_order', methods=['POST'])
+def cook_prepare_order():
+    if session.get('role') != 'cook':
+        return redirect(url_for('login'))
+    db = get_db()
+
+    order = []
+    for dish_name, quantity in zip(request.form.getlist('dish'), request.form.getlist('portions')):
+        try:
+            quantity = int(quantity or 0)
+        except ValueError:
+            flash(f'Неверное количество порций для "{dish_name}"')
             return redirect(url_for('cook_prepare'))
+        if quantity < 0 or quantity > 100:
+            flash(f'Для "{dish_name}" можно заказать от 0 до 100 порций')
+            return redirect(url_for('cook_prepare'))
+        if quantity:
+            order.append((dish_name, quantity))
 
-        db.execute('''
-            UPDATE inventory 
-            SET quantity = ROUND(quantity - ?, 2)
-            WHERE product_name = ?
-        ''', (needed, ing['ingredient']))
+    try:
+        portions = prepare_order(db, order)
+    except ProductionError as e:
+        flash(str(e))
+        return redirect(url_for('cook_prepare'))
 
-    db.execute('INSERT INTO prepared_dishes (dish_name, quantity) VALUES (?, ?)', (dish_name, quantity))
-    db.commit()
-    flash(f'Приготовлено {quantity} порций "{dish_name}"!')
+    flash(f'Приготовлено {sum(portions.values())} порций ({len(portions)} блюд)!')
     return redirect(url_for('cook_prepared'))
 
 
@@ -873,13 +2707,19 @@ def cook_prepared():
         return redirect(url_for('login'))
     db = get_db()
     unread_count = get_unread_notifications_count(session['user_id'], db)
-    prepared = db.execute('''
-        SELECT dish_name, SUM(quantity) as total
-        FROM prepared_dishes
-        GROUP BY dish_name
-        ORDER BY dish_name
-    ''').fetchall()
-    return render_template('cook/prepared.html', prepared=prepared, unread_count=unread_count)
+    latest = db.execute('SELECT id FROM prepared_dishes ORDER BY id DESC LIMIT 1').fetchone()
+    latest_id = latest['id'] if latest else 0
+
+    def render():
+        prepared = db.execute('''
+            SELECT dish_name, SUM(quantity) as total
+            FROM prepared_dishes
+            GROUP BY dish_name
+            ORDER BY dish_name
+        ''').fetchall()
+        return render_template('cook/prepared.html', prepared=prepared, unread_count=unread_count)
+
+    return conditional_page(render, (latest_id, unread_count))
 
 
 @app.route('/cook/add_dish', methods=['GET', 'POST'])
@@ -927,8 +2767,11 @@ def cook_add_dish():
                 db.execute('''
                     INSERT INTO dish_recipes (dish_name, ingredient, quantity, unit)
                     VALUES (?, ?, ?, ?)
+                    ON CONFLICT(dish_name, ingredient) DO UPDATE SET quantity = quantity + excluded.quantity
                 ''', (dish_name, ing, qty, unit))
+            intern_ingredients(db, ingredients)
             db.commit()
+            invalidate_catalog()
             flash(f'Блюдо "{dish_name}" добавлено!')
             return redirect(url_for('cook_prepare'))
         except sqlite3.IntegrityError:
@@ -943,15 +2786,14 @@ def cook_add_dish():
 def admin_dashboard():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
-    db = get_db()
+    db = get_read_db()
     unread_count = get_unread_notifications_count(session['user_id'], db)
-    total_payments = db.execute('SELECT SUM(amount) FROM payments').fetchone()[0] or 0
-    today_attendance = db.execute('''
-        SELECT COUNT(DISTINCT student_id) 
-        FROM meal_records 
-        WHERE date(taken_at) = date('now')
-    ''').fetchone()[0]
-    total_students = db.execute("SELECT COUNT(*) FROM users WHERE role = 'student'").fetchone()[0]
+    totals = db.execute('''
+        SELECT COALESCE(SUM(payments_total), 0), COALESCE(SUM(new_students), 0),
+               COALESCE(SUM(CASE WHEN day = date('now') THEN attendees END), 0)
+        FROM daily_stats
+    ''').fetchone()
+    total_payments, total_students, today_attendance = totals
 
     stats = {
         'total_payments': total_payments,
@@ -975,89 +2817,175 @@ def admin_approve_request(req_id):
         return redirect(url_for('login'))
 
     db = get_db()
-    request_row = db.execute('SELECT items, cook_id FROM purchase_requests WHERE id = ?', (req_id,)).fetchone()
-    if not request_row:
-        flash('Заявка не найдена')
+    if not approve_purchase_requests(db, session['user_id'], [req_id]):
+        flash('Заявка не найдена или уже обработана')
         return redirect(url_for('admin_dashboard'))
 
+    flash('Заявка одобрена! Продукты добавлены на склад.')
+    return redirect(url_for('admin_dashboard'))
 
-    send_notification(request_row['cook_id'], f'Ваша заявка №{req_id} одобрена! Продукты добавлены на склад.')
 
-    items_text = request_row['items']
-    lines = items_text.strip().split('\n')
+@app.route('/admin/approve_requests', methods=['POST'])
+def admin_approve_requests():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
 
-    for line in lines:
-        line = line.strip()
-        if not line or ' ' not in line:
-            continue
+    db = get_db()
+    approved = approve_purchase_requests(db, session['user_id'], request.form.getlist('req_id', type=int))
+    if approved:
+        flash(f'Одобрено заявок: {len(approved)}. Продукты добавлены на склад.')
+    else:
+        flash('Не выбрано ни одной заявки')
+    return redirect(url_for('admin_dashboard'))
 
-        parts = line.split()
-        try:
-            quantity = float(parts[-1].replace(',', '.'))
-            product_name = ' '.join(parts[:-1]).strip()
-            if not product_name:
-                continue
-            db.execute('''
-                INSERT INTO inventory (product_name, quantity, unit)
-                VALUES (?, ?, 'шт')
-                ON CONFLICT(product_name) 
-                DO UPDATE SET quantity = quantity + excluded.quantity
-            ''', (product_name, quantity))
-        except (ValueError, IndexError):
-            continue
 
-    db.execute('UPDATE purchase_requests SET status = "approved", approved_by = ? WHERE id = ?',
-               (session['user_id'], req_id))
-    db.commit()
-    flash('Заявка одобрена! Продукты добавлены на склад.')
-    return redirect(url_for('admin_dashboard'))
+OPERATIONS_PAGE_SIZE = 50
+OPERATION_SOURCES = {
+    'meal': ('Питание', '''
+        SELECT 'meal' AS kind, mr.id, mr.taken_at AS ts, mr.student_id AS user_id,
+               NULL AS amount, mr.meal_type AS detail
+        FROM meal_records mr
+        WHERE {where}
+        ORDER BY mr.taken_at DESC, mr.id DESC
+    ''', 'mr.taken_at', 'mr.id', 'mr.student_id'),
+    'payment': ('Платёж', '''
+        SELECT 'payment' AS kind, p.id, p.created_at AS ts, p.student_id AS user_id,
+               p.amount, p.payment_type AS detail
+        FROM payments p
+        WHERE {where}
+        ORDER BY p.created_at DESC, p.id DESC
+    ''', 'p.created_at', 'p.id', 'p.student_id'),
+    'purchase': ('Закупка', '''
+        SELECT 'purchase' AS kind, pr.id, pr.approved_at AS ts, pr.cook_id AS user_id,
+               NULL AS amount, pr.items AS detail
+        FROM purchase_requests pr
+        WHERE {where}
+        ORDER BY pr.approved_at DESC, pr.id DESC
+    ''', 'pr.approved_at', 'pr.id', 'pr.cook_id'),
+    'subscription': ('Абонемент', '''
+        SELECT 'subscription' AS kind, s.id, s.created_at AS ts, s.student_id AS user_id,
+               NULL AS amount, s.duration || ' до ' || s.end_date AS detail
+        FROM subscriptions s
+        WHERE {where}
+        ORDER BY s.created_at DESC, s.id DESC
+    ''', 's.created_at', 's.id', 's.student_id'),
+}
+
+
+def parse_operations_cursor(value):
+    try:
+        ts, kind, op_id = value.split('|')
+        return ts, kind, int(op_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def operations_query(kinds, user_query=None, date_from=None, date_to=None, before=None,
+                     limit=OPERATIONS_PAGE_SIZE):
+    branches = []
+    params = []
+    for kind in sorted(kinds, reverse=True):
+        label, sql, ts_column, id_column, user_column = OPERATION_SOURCES[kind]
+        where = [f'{ts_column} IS NOT NULL']
+        branch_params = []
+        if date_from:
+            where.append(f'{ts_column} >= ?')
+            branch_params.append(date_from.isoformat())
+        if date_to:
+            where.append(f'{ts_column} < ?')
+            branch_params.append((date_to + timedelta(days=1)).isoformat())
+        if user_query:
+            where.append(f'{user_column} IN (SELECT id FROM users WHERE full_name LIKE ?)')
+            branch_params.append(f'%{user_query}%')
+        if before:
+            before_ts, before_kind, before_id = before
+            if kind < before_kind:
+                where.append(f'{ts_column} <= ?')
+                branch_params.append(before_ts)
+            elif kind > before_kind:
+                where.append(f'{ts_column} < ?')
+                branch_params.append(before_ts)
+            else:
+                # Сравнение кортежей, а не OR: так SQLite идёт по индексу диапазоном и не сортирует
+                # все более старые строки на каждой странице.
+                where.append(f'({ts_column}, {id_column}) < (?, ?)')
+                branch_params.extend([before_ts, before_id])
+        branches.append(f'SELECT * FROM ({sql.format(where=" AND ".join(where))} LIMIT ?)')
+        params.extend(branch_params + [limit + 1])
+
+    if not branches:
+        return None, None
+
+    return f'''
+        SELECT ops.*, u.full_name
+        FROM ({' UNION ALL '.join(branches)}) ops
+        LEFT JOIN users u ON u.id = ops.user_id
+        ORDER BY ops.ts DESC, ops.kind DESC, ops.id DESC
+        LIMIT ?
+    ''', params + [limit + 1]
+
+
+def fetch_operations(db, kinds, user_query=None, date_from=None, date_to=None, before=None,
+                     limit=OPERATIONS_PAGE_SIZE):
+    sql, params = operations_query(kinds, user_query, date_from, date_to, before, limit)
+    if sql is None:
+        return [], None
+    rows = db.execute(sql, params).fetchall()
+
+    operations = []
+    for row in rows[:limit]:
+        if row['kind'] == 'payment':
+            category = "Абонемент" if row['detail'] == 'subscription' else "Разовое пополнение"
+            detail = f"{row['amount']:.2f} ₽ ({category})"
+        elif row['kind'] == 'purchase':
+            detail = f"Заявка №{row['id']} одобрена"
+        else:
+            detail = row['detail']
+        operations.append({
+            'type': OPERATION_SOURCES[row['kind']][0],
+            'detail': detail,
+            'user': row['full_name'],
+            'date': row['ts']
+        })
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last['ts']}|{last['kind']}|{last['id']}"
+    return operations, next_cursor
 
 
 @app.route('/admin/operations')
 def admin_operations():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
-    db = get_db()
+    db = get_read_db()
     unread_count = get_unread_notifications_count(session['user_id'], db)
-    operations = []
 
-    payments = db.execute('''
-        SELECT 'Платёж' as type, p.amount, p.payment_type, u.full_name, p.created_at
-        FROM payments p
-        JOIN users u ON p.student_id = u.id
-        ORDER BY p.created_at DESC
-        LIMIT 50
-    ''').fetchall()
+    kind = request.args.get('type', '')
+    kinds = [kind] if kind in OPERATION_SOURCES else list(OPERATION_SOURCES)
+    user_query = request.args.get('user', '').strip()
 
-    meals = db.execute('''
-        SELECT 'Питание' as type, mr.meal_type, '' as payment_type, u.full_name, mr.taken_at
-        FROM meal_records mr
-        JOIN users u ON mr.student_id = u.id
-        ORDER BY mr.taken_at DESC
-        LIMIT 50
-    ''').fetchall()
+    def parse_date(name):
+        try:
+            return date.fromisoformat(request.args.get(name, ''))
+        except ValueError:
+            return None
 
-    all_ops = []
-    for p in payments:
-        category = "Абонемент" if p['payment_type'] == 'subscription' else "Разовое пополнение"
-        all_ops.append({
-            'type': 'Платёж',
-            'detail': f"{p['amount']:.2f} ₽ ({category})",
-            'user': p['full_name'],
-            'date': p['created_at']
-        })
-    for m in meals:
-        all_ops.append({
-            'type': 'Питание',
-            'detail': m['meal_type'],
-            'user': m['full_name'],
-            'date': m['taken_at']
-        })
+    date_from = parse_date('date_from')
+    date_to = parse_date('date_to')
+    before = parse_operations_cursor(request.args.get('before'))
 
-    all_ops.sort(key=lambda x: x['date'], reverse=True)
-    operations = all_ops[:100]
+    operations, next_cursor = fetch_operations(db, kinds, user_query, date_from, date_to, before)
 
-    return render_template('admin/operations.html', operations=operations, unread_count=unread_count)
+    filters = {
+        'type': kind if kind in OPERATION_SOURCES else '',
+        'user': user_query,
+        'date_from': date_from.isoformat() if date_from else '',
+        'date_to': date_to.isoformat() if date_to else ''
+    }
+    return render_template('admin/operations.html', operations=operations, next_cursor=next_cursor,
+                           filters=filters, operation_types=OPERATION_SOURCES, unread_count=unread_count)
 
 
 @app.route('/admin/report/<period>')
@@ -1065,12 +2993,8 @@ def admin_report_csv(period):
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
 
-    db = get_db()
-    output = StringIO()
-
     headers = ["Тип записи", "Период", "Дата формирования", "ID ученика", "ФИО ученика", "Сумма / Тип питания",
                "Категория", "Дата операции"]
-    output.write(";".join(headers) + "\n")
 
     today = date.today()
     if period == 'week':
@@ -1090,6 +3014,7 @@ def admin_report_csv(period):
         filename_ru = f"Полный_отчёт_{today}.csv"
 
     report_date = datetime.now().strftime('%Y-%m-%d %H:%M')
+    use_gzip = request.args.get('gzip') == '1'
 
     def safe_str(s):
         if s is None:
@@ -1099,25 +3024,9 @@ def admin_report_csv(period):
             return f'"{s}"'
         return s
 
-    if start_date:
-        payments = db.execute('''
-            SELECT p.student_id, u.full_name, p.amount, p.payment_type, p.created_at
-            FROM payments p
-            JOIN users u ON p.student_id = u.id
-            WHERE p.created_at >= ?
-            ORDER BY p.created_at
-        ''', (start_date.isoformat(),)).fetchall()
-    else:
-        payments = db.execute('''
-            SELECT p.student_id, u.full_name, p.amount, p.payment_type, p.created_at
-            FROM payments p
-            JOIN users u ON p.student_id = u.id
-            ORDER BY p.created_at
-        ''').fetchall()
-
-    for p in payments:
+    def payment_row(p):
         category = "Абонемент" if p['payment_type'] == 'subscription' else "Разовое пополнение"
-        row = [
+        return [
             "Платёж",
             period_label,
             report_date,
@@ -1127,28 +3036,9 @@ def admin_report_csv(period):
             category,
             p['created_at'][:10]
         ]
-        output.write(";".join(row) + "\n")
-
-    if start_date:
-        meals = db.execute('''
-            SELECT mr.student_id, u.full_name, ms.meal_date, mr.meal_type
-            FROM meal_records mr
-            JOIN users u ON mr.student_id = u.id
-            JOIN menu_sets ms ON mr.menu_id = ms.id
-            WHERE mr.taken_at >= ?
-            ORDER BY mr.taken_at
-        ''', (start_date.isoformat(),)).fetchall()
-    else:
-        meals = db.execute('''
-            SELECT mr.student_id, u.full_name, ms.meal_date, mr.meal_type
-            FROM meal_records mr
-            JOIN users u ON mr.student_id = u.id
-            JOIN menu_sets ms ON mr.menu_id = ms.id
-            ORDER BY mr.taken_at
-        ''').fetchall()
 
-    for m in meals:
-        row = [
+    def meal_row(m):
+        return [
             "Питание",
             period_label,
             report_date,
@@ -1158,14 +3048,62 @@ def admin_report_csv(period):
             "",
             m['meal_date']
         ]
-        output.write(";".join(row) + "\n")
 
-    csv_data = output.getvalue().encode('utf-8-sig')
+    period_filter = 'WHERE {column} >= ?' if start_date else ''
+    params = (start_date.isoformat(),) if start_date else ()
+    sections = [
+        (f'''
+            SELECT p.student_id, u.full_name, p.amount, p.payment_type, p.created_at
+            FROM payments p
+            JOIN users u ON p.student_id = u.id
+            {period_filter.format(column='p.created_at')}
+            ORDER BY p.created_at
+        ''', payment_row),
+        (f'''
+            SELECT mr.student_id, u.full_name, ms.meal_date, mr.meal_type
+            FROM meal_records mr
+            JOIN users u ON mr.student_id = u.id
+            JOIN menu_sets ms ON mr.menu_id = ms.id
+            {period_filter.format(column='mr.taken_at')}
+            ORDER BY mr.taken_at
+        ''', meal_row),
+    ]
+
+    def generate_lines():
+        pool = get_pool(readonly=True)
+        db = pool.acquire()
+        try:
+            yield ";".join(headers) + "\n"
+            for sql, make_row in sections:
+                cursor = db.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(REPORT_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    yield "".join(";".join(make_row(row)) + "\n" for row in rows)
+        finally:
+            pool.release(db)
+
+    def generate():
+        encoder = codecs.getincrementalencoder('utf-8-sig')()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+        for text in generate_lines():
+            data = encoder.encode(text)
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+
+    if use_gzip:
+        filename += '.gz'
+        filename_ru += '.gz'
     quoted_filename = quote(filename_ru, encoding='utf-8')
 
     return Response(
-        csv_data,
-        mimetype="text/csv; charset=utf-8",
+        generate(),
+        mimetype="application/gzip" if use_gzip else "text/csv; charset=utf-8",
         headers={
             "Content-Disposition": f"attachment; filename={filename}; filename*=UTF-8''{quoted_filename}"
         }
@@ -1181,20 +3119,286 @@ def admin_reports():
     return render_template('admin/reports.html', unread_count=unread_count)
 
 
-@app.route('/admin/users')
+@app.route('/admin/metrics')
+def admin_metrics():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    lines = request_metrics.render()
+    verifier = get_password_verifier().metrics()
+    pending, stuck = get_db().execute('SELECT COUNT(*), COALESCE(SUM(attempts >= ?), 0) FROM notification_outbox',
+                                      (OUTBOX_MAX_ATTEMPTS,)).fetchone()
+    lines += [
+        '# HELP canteen_login_workers Потоков проверки паролей',
+        '# TYPE canteen_login_workers gauge',
+        f'canteen_login_workers {verifier["workers"]}',
+        '# HELP canteen_login_queue_depth Проверок паролей в очереди',
+        '# TYPE canteen_login_queue_depth gauge',
+        f'canteen_login_queue_depth {verifier["queue_depth"]}',
+        '# HELP canteen_login_queue_depth_max Наибольшая длина очереди проверок',
+        '# TYPE canteen_login_queue_depth_max gauge',
+        f'canteen_login_queue_depth_max {verifier["max_queue_depth"]}',
+        '# HELP canteen_login_verifications_total Выполненных проверок паролей',
+        '# TYPE canteen_login_verifications_total counter',
+        f'canteen_login_verifications_total {verifier["completed"]}',
+        '# HELP canteen_login_rejected_total Входов, отклонённых из-за переполнения очереди',
+        '# TYPE canteen_login_rejected_total counter',
+        f'canteen_login_rejected_total {verifier["rejected"]}',
+        '# HELP canteen_login_wait_seconds Среднее ожидание в очереди проверок',
+        '# TYPE canteen_login_wait_seconds gauge',
+        f'canteen_login_wait_seconds {verifier["avg_wait"]:.6f}',
+        '# HELP canteen_login_hash_seconds Среднее время проверки хеша',
+        '# TYPE canteen_login_hash_seconds gauge',
+        f'canteen_login_hash_seconds {verifier["avg_hash_time"]:.6f}',
+        '# HELP canteen_notification_outbox_pending Уведомлений, ожидающих доставки',
+        '# TYPE canteen_notification_outbox_pending gauge',
+        f'canteen_notification_outbox_pending {pending - stuck}',
+        '# HELP canteen_notification_outbox_failed Уведомлений, не доставленных после всех попыток '
+        '(вернуть в очередь: flask requeue-notifications)',
+        '# TYPE canteen_notification_outbox_failed gauge',
+        f'canteen_notification_outbox_failed {stuck}',
+    ]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def read_roster(data):
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = data.decode('cp1251')
+    delimiter = ';' if text.count(';') >= text.count(',') else ','
+    rows = []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter), start=1):
+        if not any(cell.strip() for cell in row):
+            continue
+        if line_no == 1 and row[0].strip().lower() in ('фио', 'full_name'):
+            continue
+        full_name = row[0].strip()
+        password = row[1].strip() if len(row) > 1 else ''
+        rows.append((line_no, full_name, password))
+    return rows
+
+
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def get_process_pool(name, workers):
+    # Процессы запускаются через spawn, а не fork: веб-процесс многопоточный (доставка уведомлений,
+    # проверка паролей), и fork унёс бы в дочерний процесс блокировки, захваченные чужими потоками.
+    # Пул создаётся один раз на процесс и переживает запросы.
+    key = (os.getpid(), name)
+    pool = _process_pools.get(key)
+    if pool is None:
+        with _process_pools_lock:
+            pool = _process_pools.get(key)
+            if pool is None:
+                pool = _process_pools[key] = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return pool
+
+
+@atexit.register
+def shutdown_process_pools():
+    for key in [key for key in _process_pools if key[0] == os.getpid()]:
+        _process_pools.pop(key).shutdown()
+
+
+def hash_passwords(passwords):
+    if len(passwords) < IMPORT_POOL_THRESHOLD or IMPORT_HASH_WORKERS < 2:
+        return [hash_password(p) for p in passwords]
+    chunksize = max(1, len(passwords) // (IMPORT_HASH_WORKERS * 4))
+    pool = get_process_pool('import', IMPORT_HASH_WORKERS)
+    return list(pool.map(hash_password, passwords, chunksize=chunksize))
+
+
+def import_students(db, rows):
+    results = []
+    seen = set()
+    pending = []
+    for line_no, full_name, password in rows:
+        if not full_name or not password:
+            results.append({'line': line_no, 'full_name': full_name, 'status': 'error',
+                            'message': 'ФИО и пароль обязательны'})
+        elif full_name in seen:
+            results.append({'line': line_no, 'full_name': full_name, 'status': 'duplicate',
+                            'message': 'Повтор в файле'})
+        else:
+            seen.add(full_name)
+            pending.append((line_no, full_name, password))
+
+    hashes = hash_passwords([password for _, _, password in pending])
+
+    for start in range(0, len(pending), IMPORT_BATCH_SIZE):
+        batch = [(line_no, full_name, password_hash) for (line_no, full_name, _), password_hash
+                 in zip(pending[start:start + IMPORT_BATCH_SIZE], hashes[start:start + IMPORT_BATCH_SIZE])]
+        names = [full_name for _, full_name, _ in batch]
+        placeholders = ', '.join('?' * len(names))
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            existing = {row[0] for row in db.execute(
+                f'SELECT full_name FROM users WHERE full_name IN ({placeholders})', names)}
+            fresh = [item for item in batch if item[1] not in existing]
+            db.executemany("INSERT INTO users (full_name, password_hash, role) VALUES (?, ?, 'student')",
+                           [(full_name, password_hash) for _, full_name, password_hash in fresh])
+            db.execute(f'''
+                INSERT INTO student_profiles (user_id, balance)
+                SELECT id, 0.0 FROM users WHERE full_name IN ({placeholders}) AND role = 'student'
+                  AND id NOT IN (SELECT user_id FROM student_profiles)
+            ''', names)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        for line_no, full_name, _ in batch:
+            if full_name in existing:
+                results.append({'line': line_no, 'full_name': full_name, 'status': 'duplicate',
+                                'message': 'Пользователь уже существует'})
+            else:
+                results.append({'line': line_no, 'full_name': full_name, 'status': 'created', 'message': ''})
+
+    results.sort(key=lambda r: r['line'])
+    return results
+
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_students_command(path):
+    with open(path, 'rb') as f:
+        rows = read_roster(f.read())
+    started = time.perf_counter()
+    results = import_students(get_db(), rows)
+    elapsed = time.perf_counter() - started
+    for r in results:
+        if r['status'] != 'created':
+            print(f"Строка {r['line']}: {r['full_name']} — {r['message']}")
+    created = sum(1 for r in results if r['status'] == 'created')
+    print(f'Создано учеников: {created} из {len(results)} за {elapsed:.1f} с')
+
+
+def key_fingerprint(key):
+    return hashlib.sha256(key).hexdigest()[:12]
+
+
+def rotate_card_tokens(keys, rows):
+    multi = MultiFernet([Fernet(k) for k in keys])
+    rotated = []
+    failed = 0
+    for user_id, token in rows:
+        try:
+            rotated.append((multi.rotate(token.encode()).decode(), user_id, token))
+        except InvalidToken:
+            failed += 1
+    return rotated, failed
+
+
+def run_card_rotation(db, keys, progress=None):
+    fingerprint = key_fingerprint(keys[0])
+    job = db.execute('''
+        SELECT id, last_user_id FROM card_key_rotations
+        WHERE key_fingerprint = ? AND status = 'running'
+        ORDER BY id DESC LIMIT 1
+    ''', (fingerprint,)).fetchone()
+    if job:
+        job_id, last_user_id = job['id'], job['last_user_id']
+    else:
+        job_id = db.execute('INSERT INTO card_key_rotations (key_fingerprint) VALUES (?)', (fingerprint,)).lastrowid
+        db.commit()
+        last_user_id = 0
+
+    pool = get_process_pool('rotation', ROTATION_WORKERS)
+    while True:
+        rows = db.execute('''
+            SELECT user_id, encrypted_card_number FROM student_profiles
+            WHERE user_id > ? AND encrypted_card_number IS NOT NULL
+            ORDER BY user_id LIMIT ?
+        ''', (last_user_id, ROTATION_CHUNK_SIZE * ROTATION_WORKERS)).fetchall()
+        if not rows:
+            break
+        chunks = [[tuple(row) for row in rows[i:i + ROTATION_CHUNK_SIZE]]
+                  for i in range(0, len(rows), ROTATION_CHUNK_SIZE)]
+        for chunk, (rotated, failed) in zip(chunks, pool.map(partial(rotate_card_tokens, keys), chunks)):
+            last_user_id = chunk[-1][0]
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany('''
+                UPDATE student_profiles SET encrypted_card_number = ?
+                WHERE user_id = ? AND encrypted_card_number = ?
+            ''', rotated)
+            db.execute('''
+                UPDATE card_key_rotations
+                SET last_user_id = ?, processed = processed + ?, failed = failed + ?
+                WHERE id = ?
+            ''', (last_user_id, len(rotated), failed, job_id))
+            db.commit()
+            if progress:
+                progress(last_user_id, len(rotated), failed)
+
+    db.execute("UPDATE card_key_rotations SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+               (job_id,))
+    db.commit()
+    return db.execute('SELECT * FROM card_key_rotations WHERE id = ?', (job_id,)).fetchone()
+
+
+@app.cli.command('rotate-card-key')
+@click.option('--resume', is_flag=True, help='Продолжить незавершённую ротацию без нового ключа')
+def rotate_card_key_command(resume):
+    keys = read_card_keys()
+    if not resume:
+        keys = [Fernet.generate_key()] + keys
+        write_card_keys(keys)
+        print(f'Новый основной ключ: {key_fingerprint(keys[0])}')
+
+    def progress(last_user_id, rotated, failed):
+        print(f'  до user_id={last_user_id}: перешифровано {rotated}, ошибок {failed}')
+
+    job = run_card_rotation(get_db(), keys, progress)
+    print(f'Готово: перешифровано {job["processed"]}, ошибок {job["failed"]}')
+
+
+@app.cli.command('retire-card-keys')
+def retire_card_keys_command():
+    keys = read_card_keys()
+    done = get_db().execute('''
+        SELECT 1 FROM card_key_rotations WHERE key_fingerprint = ? AND status = 'done' AND failed = 0
+    ''', (key_fingerprint(keys[0]),)).fetchone()
+    if not done:
+        print('Ротация на текущий ключ не завершена или есть нерасшифрованные карты — старые ключи оставлены')
+        return
+    write_card_keys(keys[:1])
+    print(f'Удалено старых ключей: {len(keys) - 1}')
+
+
+@app.route('/admin/users', methods=['GET', 'POST'])
 def admin_users():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
     db = get_db()
     unread_count = get_unread_notifications_count(session['user_id'], db)
-    users = db.execute('''
-        SELECT id, full_name, role 
-        FROM users 
-        WHERE role IN ('student', 'cook')
-        ORDER BY role, full_name
-    ''').fetchall()
-    return render_template('admin/users.html', users=users, unread_count=unread_count)
+    import_results = None
+    if request.method == 'POST':
+        roster = request.files.get('roster')
+        if not roster or not roster.filename:
+            flash('Выберите CSV-файл со списком учеников')
+            return redirect(url_for('admin_users'))
+        import_results = import_students(db, read_roster(roster.read()))
+        created = sum(1 for r in import_results if r['status'] == 'created')
+        flash(f'Импорт завершён: создано {created} из {len(import_results)}')
+
+    def render():
+        users = db.execute('''
+            SELECT id, full_name, role 
+            FROM users 
+            WHERE role IN ('student', 'cook')
+            ORDER BY role, full_name
+        ''').fetchall()
+        return render_template('admin/users.html', users=users, import_results=import_results,
+                               unread_count=unread_count)
 
+    if import_results is not None:
+        return render()
+    latest = db.execute('SELECT id FROM users ORDER BY id DESC LIMIT 1').fetchone()
+    return conditional_page(render, (latest['id'], unread_count))
 
 
 @app.route('/notifications')
@@ -1210,8 +3414,9 @@ def notifications():
         ORDER BY created_at DESC
     ''', (session['user_id'],)).fetchall()
 
-    db.execute('UPDATE notifications SET is_read = 1 WHERE user_id = ?', (session['user_id'],))
+    db.execute('UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0', (session['user_id'],))
     db.commit()
+    forget_unread_count(session['user_id'])
 
     unread_count = 0
     return render_template('notifications.html', notifications=notifs, unread_count=unread_count)
@@ -1225,9 +3430,574 @@ def delete_notification(notification_id):
     db = get_db()
     db.execute('DELETE FROM notifications WHERE id = ? AND user_id = ?', (notification_id, session['user_id']))
     db.commit()
+    forget_unread_count(session['user_id'])
     return redirect(url_for('notifications'))
 
 
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+
+def api_denied(role=None):
+    if 'user_id' not in session:
+        return api_error('Требуется вход', 401)
+    if role and session.get('role') != role:
+        return api_error('Недостаточно прав', 403)
+    return None
+
+
+class ApiRequestError(Exception):
+    pass
+
+
+def api_request_data():
+    if not request.is_json:
+        return request.form
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ApiRequestError('Тело запроса должно быть JSON-объектом')
+    return data
+
+
+def api_profile(db, student_id):
+    profile = db.execute('SELECT balance, allergy_mask, preference_mask FROM student_profiles WHERE user_id = ?',
+                         (student_id,)).fetchone()
+    if not profile:
+        return 0, 0, 0
+    return profile['balance'], int(profile['allergy_mask'] or '0', 16), int(profile['preference_mask'] or '0', 16)
+
+
+def api_menu(catalog, today, days, taken_types, allergy_mask, preference_mask):
+    menu = []
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        menu_set = catalog.menu_for(day)
+        if not menu_set:
+            continue
+        meals = {}
+        for meal_type in ('breakfast', 'lunch'):
+            dishes = []
+            for dish in meal_dishes(menu_set, meal_type):
+                dish_mask = catalog.dish_masks.get(dish, 0)
+                dishes.append({
+                    'name': dish,
+                    'price': catalog.prices.get(dish, 0),
+                    'allergens': catalog.mask_names(dish_mask & allergy_mask),
+                    'preferred': bool(dish_mask & preference_mask),
+                })
+            meals[meal_type] = {
+                'price': menu_set[f'{meal_type}_price'],
+                'taken': day == today and meal_type in taken_types,
+                'dishes': dishes,
+            }
+        menu.append({'date': day.isoformat(), 'meals': meals})
+    return menu
+
+
+def api_account(db, student_id, balance, today):
+    sub = db.execute('''
+        SELECT duration, start_date, end_date
+        FROM subscriptions
+        WHERE student_id = ? AND status = 'active' AND end_date >= ?
+        ORDER BY end_date DESC
+        LIMIT 1
+    ''', (student_id, today)).fetchone()
+    subscription = None
+    if sub:
+        subscription = {
+            'duration': sub['duration'],
+            'start_date': str(sub['start_date']),
+            'end_date': str(sub['end_date']),
+            'active': has_active_subscription(student_id, db),
+        }
+    return {'balance': balance, 'subscription': subscription}
+
+
+def api_notifications(db, user_id):
+    rows = db.execute('''
+        SELECT id, message, is_read, created_at
+        FROM notifications
+        WHERE user_id = ?
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', (user_id, API_NOTIFICATIONS_LIMIT)).fetchall()
+    return {
+        'unread': get_unread_notifications_count(user_id, db),
+        'items': [{'id': row['id'], 'message': row['message'], 'is_read': bool(row['is_read']),
+                   'created_at': row['created_at']} for row in rows],
+    }
+
+
+@app.route('/api/v1/login', methods=['POST'])
+def api_login():
+    try:
+        data = api_request_data()
+    except ApiRequestError as e:
+        return api_error(str(e), 400)
+    full_name = data.get('full_name')
+    password = data.get('password')
+    if not isinstance(full_name, str) or not isinstance(password, str) or not full_name or not password:
+        return api_error('Укажите ФИО и пароль', 400)
+    try:
+        user = authenticate(get_db(), full_name, password)
+    except VerifierOverloaded:
+        return api_error('Слишком много входов одновременно, попробуйте через несколько секунд', 503)
+    if not user:
+        return api_error('Неверное ФИО или пароль', 401)
+    session['user_id'] = user['id']
+    session['role'] = user['role']
+    session['full_name'] = user['full_name']
+    return jsonify({'id': user['id'], 'full_name': user['full_name'], 'role': user['role']})
+
+
+@app.route('/api/v1/logout', methods=['POST'])
+def api_logout():
+    session.clear()
+    return jsonify({})
+
+
+@app.route('/api/v1/menu')
+def api_menu_view():
+    denied = api_denied('student')
+    if denied:
+        return denied
+    days = request.args.get('days', 1, type=int)
+    if not 1 <= days <= API_MENU_MAX_DAYS:
+        return api_error(f'days должен быть от 1 до {API_MENU_MAX_DAYS}', 400)
+
+    db = get_db()
+    today = date.today()
+    catalog = get_catalog(db)
+    taken_types = taken_meal_types(db, session['user_id'], today)
+    _, allergy_mask, preference_mask = api_profile(db, session['user_id'])
+
+    def render():
+        return jsonify({'menu': api_menu(catalog, today, days, taken_types, allergy_mask, preference_mask)})
+
+    version = (catalog.version, today, days, sorted(taken_types), allergy_mask, preference_mask)
+    return conditional_page(render, version)
+
+
+@app.route('/api/v1/balance')
+def api_balance():
+    denied = api_denied('student')
+    if denied:
+        return denied
+    db = get_db()
+    balance, _, _ = api_profile(db, session['user_id'])
+    return jsonify(api_account(db, session['user_id'], balance, date.today()))
+
+
+@app.route('/api/v1/meals/<meal_type>', methods=['POST'])
+def api_get_meal(meal_type):
+    denied = api_denied('student')
+    if denied:
+        return denied
+    if meal_type not in ('breakfast', 'lunch'):
+        return api_error('Неверный тип питания', 404)
+
+    db = get_db()
+    try:
+        charged, by_subscription = checkout_meal(db, session['user_id'], session['full_name'], meal_type)
+    except CheckoutError as e:
+        return api_error(str(e), 409)
+    balance, _, _ = api_profile(db, session['user_id'])
+    return jsonify({'meal_type': meal_type, 'charged': charged, 'subscription': by_subscription,
+                    'balance': balance})
+
+
+@app.route('/api/v1/notifications')
+def api_notifications_view():
+    denied = api_denied()
+    if denied:
+        return denied
+    return jsonify(api_notifications(get_db(), session['user_id']))
+
+
+@app.route('/api/v1/notifications/read', methods=['POST'])
+def api_read_notifications():
+    denied = api_denied()
+    if denied:
+        return denied
+    db = get_db()
+    db.execute('UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0', (session['user_id'],))
+    db.commit()
+    forget_unread_count(session['user_id'])
+    return jsonify({'unread': 0})
+
+
+@app.route('/api/v1/notifications/<int:notification_id>', methods=['DELETE'])
+def api_delete_notification(notification_id):
+    denied = api_denied()
+    if denied:
+        return denied
+    db = get_db()
+    deleted = db.execute('DELETE FROM notifications WHERE id = ? AND user_id = ?',
+                         (notification_id, session['user_id'])).rowcount
+    db.commit()
+    if not deleted:
+        return api_error('Уведомление не найдено', 404)
+    forget_unread_count(session['user_id'])
+    return jsonify({'unread': get_unread_notifications_count(session['user_id'], db)})
+
+
+@app.route('/api/v1/serve/<meal_type>', methods=['POST'])
+def api_serve(meal_type):
+    denied = api_denied('cook')
+    if denied:
+        return denied
+    if meal_type not in ('breakfast', 'lunch'):
+        return api_error('Неверный тип питания', 404)
+
+    try:
+        students = api_request_data().get('students', '')
+    except ApiRequestError as e:
+        return api_error(str(e), 400)
+    if isinstance(students, list):
+        students = ' '.join(str(student_id) for student_id in students)
+    if not isinstance(students, str):
+        return api_error('students должен быть списком или строкой номеров', 400)
+    try:
+        results = issue_meals(get_db(), parse_student_queue(students), meal_type)
+    except CheckoutError as e:
+        return api_error(str(e), 409)
+    return jsonify({'meal_type': meal_type, 'results': results})
+
+
+@app.route('/api/v1/startup')
+def api_startup():
+    denied = api_denied('student')
+    if denied:
+        return denied
+    db = get_db()
+    today = date.today()
+    catalog = get_catalog(db)
+    taken_types = taken_meal_types(db, session['user_id'], today)
+    balance, allergy_mask, preference_mask = api_profile(db, session['user_id'])
+    return jsonify({
+        'user': {'id': session['user_id'], 'full_name': session['full_name'], 'role': session['role']},
+        'today': today.isoformat(),
+        'account': api_account(db, session['user_id'], balance, today),
+        'menu': api_menu(catalog, today, API_STARTUP_MENU_DAYS, taken_types, allergy_mask, preference_mask),
+        'allergies': catalog.mask_names(allergy_mask, db),
+        'preferences': catalog.mask_names(preference_mask, db),
+        'notifications': api_notifications(db, session['user_id']),
+    })
+
+
+SYNTHETIC_COURSES = (
+    ('breakfast_main', 'Овсяная каша'),
+    ('breakfast_drink', 'Какао'),
+    ('lunch_first', 'Борщ'),
+    ('lunch_second', 'Котлета с картошкой'),
+    ('lunch_drink', 'Компот'),
+)
+
+
+def school_days(start, end):
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+def generate_school_data(db, students, days, dishes, notifications, seed):
+    rng = random.Random(seed)
+    today = date.today()
+    start = today - timedelta(days=days)
+    if db.execute("SELECT 1 FROM users WHERE full_name LIKE 'Ученик %' LIMIT 1").fetchone():
+        raise click.ClickException('В базе уже есть синтетические ученики')
+
+    catalog = get_catalog(db)
+    courses = {}
+    for slot, base in SYNTHETIC_COURSES:
+        courses[slot] = [base]
+        for k in range(1, max(dishes // len(SYNTHETIC_COURSES), 0) + 1):
+            name = f'{base} №{k}'
+            scale = rng.uniform(0.8, 1.2)
+            db.execute('INSERT OR IGNORE INTO dishes (name, price) VALUES (?, ?)',
+                       (name, round(catalog.prices[base] * rng.uniform(0.8, 1.3))))
+            db.executemany('''
+                INSERT OR IGNORE INTO dish_recipes (dish_name, ingredient, quantity, unit) VALUES (?, ?, ?, ?)
+            ''', [(name, ing['ingredient'], round(ing['quantity'] * scale, 3), ing['unit'])
+                  for ing in catalog.recipes[base]])
+            courses[slot].append(name)
+    prices = dict(db.execute('SELECT name, price FROM dishes').fetchall())
+
+    db.executemany('''
+        INSERT OR IGNORE INTO menu_sets (meal_date, breakfast_main, breakfast_drink, lunch_first, lunch_second, lunch_drink)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(day.isoformat(),) + tuple(rng.choice(courses[slot]) for slot, _ in SYNTHETIC_COURSES)
+          for day in school_days(start, today + timedelta(days=PLANNER_MAX_DAYS))])
+    menus = {row['meal_date']: row for row in db.execute('SELECT * FROM menu_sets WHERE meal_date >= ?',
+                                                         (start.isoformat(),))}
+
+    password_hash = hash_password('student')
+    first_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0] + 1
+    db.executemany('''
+        INSERT INTO users (full_name, password_hash, role, created_at) VALUES (?, ?, 'student', ?)
+    ''', [(f'Ученик {i:05d}', password_hash, f'{start} 08:00:00') for i in range(1, students + 1)])
+    student_ids = [row[0] for row in db.execute("SELECT id FROM users WHERE id >= ? AND role = 'student'",
+                                                (first_id,))]
+    db.executemany('INSERT INTO student_profiles (user_id, balance) VALUES (?, ?)',
+                   [(user_id, round(rng.uniform(0, 2000), 2)) for user_id in student_ids])
+
+    subscribers = set(rng.sample(student_ids, len(student_ids) // 4))
+    db.executemany('''
+        INSERT INTO subscriptions (student_id, duration, start_date, end_date, created_at)
+        VALUES (?, 'year', ?, ?, ?)
+    ''', [(user_id, start, start + timedelta(days=365), f'{start} 08:00:00') for user_id in subscribers])
+    db.executemany('''
+        INSERT INTO payments (student_id, amount, payment_type, description, created_at)
+        VALUES (?, 10000, 'subscription', 'Абонемент на year', ?)
+    ''', [(user_id, f'{start} 08:00:00') for user_id in subscribers])
+
+    meals = 0
+    for day in school_days(start, today - timedelta(days=1)):
+        menu = menus.get(day.isoformat())
+        if not menu:
+            continue
+        records = []
+        payments = []
+        for user_id in student_ids:
+            for meal_type, chance, hour in (('breakfast', 0.6, 8), ('lunch', 0.8, 12)):
+                if rng.random() >= chance:
+                    continue
+                taken_at = f'{day} {hour:02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}'
+                records.append((user_id, menu['id'], meal_type, taken_at))
+                if user_id not in subscribers:
+                    amount = sum(prices[dish] for dish in meal_dishes(menu, meal_type))
+                    payments.append((user_id, amount, f'Оплата за {meal_type}', taken_at))
+        db.executemany('''
+            INSERT INTO meal_records (student_id, menu_id, meal_type, taken_at, confirmed) VALUES (?, ?, ?, ?, 1)
+        ''', records)
+        db.executemany('''
+            INSERT INTO payments (student_id, amount, payment_type, description, created_at)
+            VALUES (?, ?, 'one-time', ?, ?)
+        ''', payments)
+        meals += len(records)
+
+    history = list(school_days(start, today))
+    db.executemany('''
+        INSERT INTO notifications (user_id, message, is_read, created_at) VALUES (?, ?, ?, ?)
+    ''', [(user_id, f'Уведомление №{n + 1}', int(n < notifications - 3), f'{history[n * len(history) // notifications]} 09:00:00')
+          for user_id in student_ids for n in range(notifications)] if history else [])
+
+    db.commit()
+    db.execute('ANALYZE')
+    invalidate_catalog()
+    forget_role_user_ids()
+    return {'students': len(student_ids), 'dishes': sum(len(names) for names in courses.values()),
+            'menus': len(menus), 'meals': meals}
+
+
+@app.cli.command('seed-data')
+@click.option('--students', default=5000, help='Количество учеников')
+@click.option('--days', default=270, help='Глубина истории в днях')
+@click.option('--dishes', default=40, help='Количество дополнительных блюд')
+@click.option('--notifications', default=20, help='Уведомлений на ученика')
+@click.option('--seed', default=1, help='Зерно генератора случайных чисел')
+def seed_data_command(students, days, dishes, notifications, seed):
+    init_db()
+    started = time.perf_counter()
+    counts = generate_school_data(get_db(), students, days, dishes, notifications, seed)
+    print(f'Учеников: {counts["students"]}, блюд: {counts["dishes"]}, меню: {counts["menus"]}, '
+          f'выдач: {counts["meals"]} за {time.perf_counter() - started:.1f} с')
+
+
+BENCH_USERS = {
+    'student': ('Шнец Владимир Владимирович', 'student'),
+    'cook': ('Сидоров Сидор Сидорович', 'cook'),
+    'admin': ('Петров Иван Сергеевич', 'admin'),
+}
+BENCH_CASES = (
+    (None, 'GET', '/login', None),
+    (None, 'POST', '/login', {'full_name': 'Шнец Владимир Владимирович', 'password': 'student'}),
+    (None, 'GET', '/register', None),
+    (None, 'POST', '/register', {'full_name': 'Шнец Владимир Владимирович', 'password': 'student'}),
+    (None, 'GET', '/logout', None),
+    ('student', 'GET', '/', None),
+    ('student', 'GET', '/student/dashboard', None),
+    ('student', 'GET', '/student/menu', None),
+    ('student', 'GET', '/student/get_meal/breakfast', None),
+    ('student', 'GET', '/student/payment', None),
+    ('student', 'POST', '/student/payment', {'duration': 'week'}),
+    ('student', 'GET', '/student/card_topup', None),
+    ('student', 'POST', '/student/card_topup', {'amount': '500', 'card_number': '4111111111111111',
+                                                'expiry': '12/30', 'cvv': '123'}),
+    ('student', 'GET', '/student/profile', None),
+    ('student', 'POST', '/student/profile', {'allergies': 'молоко', 'preferences': 'каша'}),
+    ('student', 'GET', '/student/reviews', None),
+    ('student', 'POST', '/student/reviews', {'dish': 'Борщ', 'rating': '5', 'comment': 'Вкусно'}),
+    ('student', 'GET', '/notifications', None),
+    ('student', 'GET', '/notification/0/delete', None),
+    ('cook', 'GET', '/cook/dashboard', None),
+    ('cook', 'GET', '/cook/confirm_meal/1', None),
+    ('cook', 'GET', '/cook/serve', None),
+    ('cook', 'POST', '/cook/serve', {'meal_type': 'lunch', 'students': '3 4 5 6 7'}),
+    ('cook', 'GET', '/cook/inventory', None),
+    ('cook', 'POST', '/cook/inventory', {'product': 'Сахар', 'quantity': '5', 'unit': ''}),
+    ('cook', 'GET', '/cook/planner', None),
+    ('cook', 'GET', '/cook/prepare', None),
+    ('cook', 'POST', '/cook/prepare_dish/Компот', {'quantity': '1'}),
+    ('cook', 'POST', '/cook/prepare_order', {'dish': ['Какао', 'Компот'], 'portions': ['1', '1']}),
+    ('cook', 'GET', '/cook/prepared', None),
+    ('cook', 'GET', '/cook/add_dish', None),
+    ('cook', 'POST', '/cook/add_dish', {'dish_name': 'Чай', 'price': '10', 'ingredient[]': ['Сахар'],
+                                        'quantity[]': ['0.01'], 'unit[]': ['кг']}),
+    ('admin', 'GET', '/admin/dashboard', None),
+    ('admin', 'GET', '/admin/approve_request/0', None),
+    ('admin', 'POST', '/admin/approve_requests', {}),
+    ('admin', 'GET', '/admin/operations', None),
+    ('admin', 'GET', '/admin/reports', None),
+    ('admin', 'GET', '/admin/report/week', None),
+    ('admin', 'GET', '/admin/report/all?gzip=1', None),
+    ('admin', 'GET', '/admin/metrics', None),
+    ('admin', 'GET', '/admin/users', None),
+    ('admin', 'POST', '/admin/users', {}),
+    (None, 'POST', '/api/v1/login', {'full_name': 'Шнец Владимир Владимирович', 'password': 'student'}),
+    (None, 'POST', '/api/v1/logout', None),
+    ('cook', 'POST', '/api/v1/serve/breakfast', {'students': '3 4 5 6 7'}),
+    ('student', 'GET', '/api/v1/startup', None),
+    ('student', 'GET', '/api/v1/menu?days=7', None),
+    ('student', 'GET', '/api/v1/balance', None),
+    ('student', 'POST', '/api/v1/meals/lunch', None),
+    ('student', 'GET', '/api/v1/notifications', None),
+    ('student', 'POST', '/api/v1/notifications/read', None),
+    ('student', 'DELETE', '/api/v1/notifications/0', None),
+)
+
+
+def close_pools(path):
+    for key in [key for key in _pools if key[1] == path]:
+        pool = _pools.pop(key)
+        while not pool.idle.empty():
+            pool.idle.get_nowait().close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_benchmarks(rounds, warmup, only=None):
+    thread_id = threading.get_ident()
+    statements = [0]
+    last_statement = [None]
+
+    def count_statement(sql):
+        if threading.get_ident() == thread_id and sql != last_statement[0]:
+            statements[0] += 1
+            last_statement[0] = sql
+
+    results = {}
+    _statement_hooks.append(count_statement)
+    try:
+        clients = {}
+        for role, (full_name, password) in BENCH_USERS.items():
+            clients[role] = app.test_client()
+            clients[role].post('/login', data={'full_name': full_name, 'password': password})
+        anonymous = app.test_client()
+
+        for role, method, path, data in BENCH_CASES:
+            if only and only not in path:
+                continue
+            client = clients[role] if role else anonymous
+
+            def call():
+                last_statement[0] = None
+                response = client.open(path, method=method, data=data)
+                response.get_data()
+                response.close()
+                return response.status_code
+
+            for _ in range(warmup):
+                call()
+            timings = []
+            statements[0] = 0
+            for _ in range(rounds):
+                started = time.perf_counter()
+                status = call()
+                timings.append(time.perf_counter() - started)
+            queries = statements[0] / rounds
+
+            tracemalloc.start()
+            call()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[f'{method} {path}'] = {
+                'role': role,
+                'status': status,
+                'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+                'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+                'queries': round(queries, 2),
+                'peak_kb': round(peak / 1024, 1),
+            }
+    finally:
+        _statement_hooks.remove(count_statement)
+    return results
+
+
+@app.cli.command('bench')
+@click.option('--rounds', default=20, help='Замеров на каждый маршрут')
+@click.option('--warmup', default=3, help='Прогревочных запросов на каждый маршрут')
+@click.option('--output', default='.bench-results.json', type=click.Path(dir_okay=False),
+              help='Файл для результатов в формате JSON')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help='Предыдущие результаты для сравнения')
+@click.option('--only', help='Замерять только маршруты, содержащие эту строку')
+def bench_command(rounds, warmup, output, compare, only):
+    global DATABASE
+    source = DATABASE
+    workdir = os.path.join(os.path.dirname(os.path.abspath(source)), f'.bench-{os.getpid()}.db')
+    src, dst = sqlite3.connect(source), sqlite3.connect(workdir)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+    DATABASE = workdir
+    try:
+        init_db()
+        with app.app_context():
+            db = get_db()
+            sizes = {table: db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                     for table in ('users', 'dishes', 'menu_sets', 'meal_records', 'payments', 'notifications')}
+        adapter = app.url_map.bind('localhost')
+        endpoints = {adapter.match(path.split('?')[0], method=method)[0] for _, method, path, _ in BENCH_CASES}
+        missing = sorted(rule.endpoint for rule in app.url_map.iter_rules()
+                         if rule.endpoint != 'static' and rule.endpoint not in endpoints)
+        if missing:
+            print(f'Маршруты без замеров: {", ".join(missing)}')
+        close_pools(workdir)
+        # Запросы идут из отдельного потока: в потоке команды уже есть контекст приложения CLI,
+        # и тестовый клиент переиспользовал бы его вместе с g и соединением между запросами.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = executor.submit(run_benchmarks, rounds, warmup, only).result()
+    finally:
+        flush_outboxes()
+        close_pools(workdir)
+        DATABASE = source
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(workdir + suffix):
+                os.remove(workdir + suffix)
+
+    previous = {}
+    if compare:
+        with open(compare, encoding='utf-8') as f:
+            previous = json.load(f)['routes']
+    for name, r in results.items():
+        line = f'{name:45} {r["status"]}  p50 {r["p50_ms"]:8.2f} мс  p95 {r["p95_ms"]:8.2f} мс  ' \
+               f'запросов {r["queries"]:6.1f}  память {r["peak_kb"]:8.1f} КБ'
+        if name in previous and previous[name]['p50_ms']:
+            line += f'  ({(r["p50_ms"] / previous[name]["p50_ms"] - 1) * 100:+.0f}% p50)'
+        print(line)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'created_at': datetime.now().isoformat(timespec='seconds'), 'rounds': rounds,
+                   'database': sizes, 'routes': results}, f, ensure_ascii=False, indent=2)
+    print(f'Результаты записаны в {output}')
+
 if __name__ == '__main__':
     init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
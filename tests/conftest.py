@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+import app as canteen
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = str(tmp_path / 'canteen.db')
+    monkeypatch.setattr(canteen, 'DATABASE', path)
+    canteen.init_db()
+    yield path
+    canteen.flush_outboxes()
+    canteen.close_outboxes(path)
+    canteen.close_pools(path)
+
+
+def connect(path):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def add_students(path, count, balance):
+    db = connect(path)
+    ids = []
+    for i in range(count):
+        user_id = db.execute("INSERT INTO users (full_name, password_hash, role) VALUES (?, 'x', 'student')",
+                             (f'Ученик {i}',)).lastrowid
+        db.execute('INSERT INTO student_profiles (user_id, balance) VALUES (?, ?)', (user_id, balance))
+        ids.append(user_id)
+    db.commit()
+    db.close()
+    return ids
+
+
+def set_stock(path, product, quantity):
+    db = connect(path)
+    current = db.execute('SELECT quantity FROM inventory_stock WHERE product_name = ?', (product,)).fetchone()[0]
+    db.execute("INSERT INTO inventory_movements (product_name, delta, kind, source) VALUES (?, ?, 'adjust', 'test')",
+               (product, quantity - current))
+    db.commit()
+    db.close()
@@ -0,0 +1,43 @@
+import pytest
+
+import app as canteen
+
+
+@pytest.fixture
+def client(database):
+    return canteen.app.test_client()
+
+
+def login(client, full_name, password):
+    return client.post('/api/v1/login', json={'full_name': full_name, 'password': password})
+
+
+@pytest.mark.parametrize('body', ['{"full_name": ', '[]', '"text"', 'null'])
+def test_login_rejects_body_that_is_not_a_json_object(client, body):
+    response = client.post('/api/v1/login', data=body, content_type='application/json')
+
+    assert response.status_code == 400
+    assert response.json == {'error': 'Тело запроса должно быть JSON-объектом'}
+
+
+@pytest.mark.parametrize('body', [{}, {'full_name': 'Шнец Владимир Владимирович'}, {'full_name': 1, 'password': 2}])
+def test_login_requires_name_and_password(client, body):
+    assert client.post('/api/v1/login', json=body).status_code == 400
+
+
+def test_login_accepts_form_and_json(client):
+    assert client.post('/api/v1/login', data={'full_name': 'Шнец Владимир Владимирович',
+                                              'password': 'student'}).status_code == 200
+    assert login(client, 'Шнец Владимир Владимирович', 'wrong').status_code == 401
+    assert login(client, 'Шнец Владимир Владимирович', 'student').json['role'] == 'student'
+
+
+def test_serve_validates_body(client):
+    login(client, 'Сидоров Сидор Сидорович', 'cook')
+
+    assert client.post('/api/v1/serve/lunch', data='{', content_type='application/json').status_code == 400
+    assert client.post('/api/v1/serve/lunch', json=[3]).status_code == 400
+    assert client.post('/api/v1/serve/lunch', json={'students': {'id': 3}}).status_code == 400
+    response = client.post('/api/v1/serve/lunch', json={'students': [3]})
+    assert response.status_code == 200
+    assert [result['student_id'] for result in response.json['results']] == [3]
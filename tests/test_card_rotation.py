@@ -0,0 +1,26 @@
+from cryptography.fernet import Fernet
+
+import app as canteen
+from conftest import add_students, connect
+
+
+def test_card_rotation_reencrypts_with_new_key(database, monkeypatch):
+    monkeypatch.setattr(canteen, 'ROTATION_CHUNK_SIZE', 2)
+    monkeypatch.setattr(canteen, 'ROTATION_WORKERS', 2)
+    old_key, new_key = Fernet.generate_key(), Fernet.generate_key()
+    students = add_students(database, 5, 0)
+    cards = {user_id: f'4000 0000 0000 {user_id:04d}' for user_id in students[:4]}
+    db = connect(database)
+    db.executemany('UPDATE student_profiles SET encrypted_card_number = ? WHERE user_id = ?',
+                   [(Fernet(old_key).encrypt(card.encode()).decode(), user_id) for user_id, card in cards.items()])
+    db.execute("UPDATE student_profiles SET encrypted_card_number = 'испорчено' WHERE user_id = ?", (students[4],))
+    db.commit()
+    progress = []
+
+    job = canteen.run_card_rotation(db, [new_key, old_key], lambda *args: progress.append(args))
+
+    assert (job['status'], job['processed'], job['failed']) == ('done', 4, 1)
+    assert [last_user_id for last_user_id, _, _ in progress] == [students[1], students[3], students[4]]
+    tokens = dict(db.execute('SELECT user_id, encrypted_card_number FROM student_profiles'
+                             ' WHERE encrypted_card_number IS NOT NULL'))
+    assert {user_id: Fernet(new_key).decrypt(tokens[user_id].encode()).decode() for user_id in cards} == cards
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+import app as canteen
+from conftest import add_students, connect, set_stock
+
+LUNCH_PRICE = 145
+
+
+def checkout_in_parallel(calls):
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def checkout(index, student_id, meal_type):
+        barrier.wait()
+        with canteen.app.app_context():
+            try:
+                results[index] = canteen.checkout_meal(canteen.get_db(), student_id, f'Ученик {student_id}',
+                                                       meal_type)
+            except canteen.CheckoutError as e:
+                results[index] = e
+
+    threads = [threading.Thread(target=checkout, args=(index,) + call) for index, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_parallel_checkouts_do_not_oversell(database):
+    students = add_students(database, 20, 1000)
+    set_stock(database, 'Фарш', 0.15 * 5 + 0.01)
+
+    results = checkout_in_parallel([(student_id, 'lunch') for student_id in students])
+
+    served = [r for r in results if not isinstance(r, Exception)]
+    assert len(served) == 5
+    assert all('Фарш' in str(r) for r in results if isinstance(r, Exception))
+    db = connect(database)
+    assert db.execute("SELECT quantity FROM inventory_stock WHERE product_name = 'Фарш'").fetchone()[0] == \
+        pytest.approx(0.01)
+    assert db.execute("SELECT COUNT(*) FROM meal_records WHERE meal_type = 'lunch'").fetchone()[0] == 5
+    assert db.execute('SELECT COUNT(*) FROM payments').fetchone()[0] == 5
+    balances = [row[0] for row in db.execute(
+        f'SELECT balance FROM student_profiles WHERE user_id IN ({", ".join("?" * len(students))})', students)]
+    assert sorted(balances) == [1000 - LUNCH_PRICE] * 5 + [1000] * 15
+
+
+def test_parallel_checkouts_charge_a_student_once(database):
+    student_id, = add_students(database, 1, 1000)
+
+    results = checkout_in_parallel([(student_id, 'lunch')] * 10)
+
+    assert sum(not isinstance(r, Exception) for r in results) == 1
+    db = connect(database)
+    assert db.execute('SELECT balance FROM student_profiles WHERE user_id = ?', (student_id,)).fetchone()[0] == \
+        1000 - LUNCH_PRICE
+    assert db.execute('SELECT COUNT(*) FROM payments WHERE student_id = ?', (student_id,)).fetchone()[0] == 1
+    assert db.execute('SELECT COUNT(*) FROM meal_records WHERE student_id = ?', (student_id,)).fetchone()[0] == 1
+
+
+def test_parallel_checkouts_never_overdraw(database):
+    student_id, = add_students(database, 1, LUNCH_PRICE + 10)
+
+    checkout_in_parallel([(student_id, meal_type) for meal_type in ('breakfast', 'lunch') * 5])
+
+    db = connect(database)
+    balance = db.execute('SELECT balance FROM student_profiles WHERE user_id = ?', (student_id,)).fetchone()[0]
+    charged = db.execute('SELECT COALESCE(SUM(amount), 0) FROM payments WHERE student_id = ?',
+                         (student_id,)).fetchone()[0]
+    assert balance >= 0
+    assert balance + charged == LUNCH_PRICE + 10
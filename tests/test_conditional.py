@@ -0,0 +1,27 @@
+import app as canteen
+from conftest import connect
+
+
+def login(full_name, password):
+    client = canteen.app.test_client()
+    client.post('/login', data={'full_name': full_name, 'password': password})
+    return client
+
+
+def test_if_modified_since_alone_does_not_hide_new_notifications(database):
+    client = login('Сидоров Сидор Сидорович', 'cook')
+    first = client.get('/cook/prepared')
+    assert first.status_code == 200
+    assert 'Last-Modified' not in first.headers
+    assert client.get('/cook/prepared', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    db = connect(database)
+    db.execute("INSERT INTO notifications (user_id, message) VALUES (2, 'Новое')")
+    db.commit()
+    canteen.forget_unread_count(2)
+
+    headers = {'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}
+    assert client.get('/cook/prepared', headers=headers).status_code == 200
+    again = client.get('/cook/prepared', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 200
+    assert again.headers['ETag'] != first.headers['ETag']
@@ -0,0 +1,28 @@
+import io
+import os
+
+from werkzeug.security import check_password_hash
+
+import app as canteen
+from conftest import connect
+
+
+def test_import_hashes_passwords_in_shared_process_pool(database, monkeypatch):
+    monkeypatch.setattr(canteen, 'IMPORT_POOL_THRESHOLD', 2)
+    monkeypatch.setattr(canteen, 'IMPORT_HASH_WORKERS', 2)
+    client = canteen.app.test_client()
+    client.post('/login', data={'full_name': 'Петров Иван Сергеевич', 'password': 'admin'})
+    roster = 'ФИО;Пароль\nАнна;a1\nБорис;b2\nАнна;a3\nШнец Владимир Владимирович;x\nВера;\nГлеб;g4\n'
+
+    page = client.post('/admin/users', data={'roster': (io.BytesIO(roster.encode()), 'roster.csv')},
+                       content_type='multipart/form-data').get_data(as_text=True)
+
+    assert 'Импорт завершён: создано 3 из 6' in page
+    db = connect(database)
+    hashes = dict(db.execute("SELECT full_name, password_hash FROM users WHERE full_name IN ('Анна', 'Борис', 'Глеб')"))
+    assert all(check_password_hash(hashes[name], password)
+               for name, password in (('Анна', 'a1'), ('Борис', 'b2'), ('Глеб', 'g4')))
+    pool = canteen._process_pools[(os.getpid(), 'import')]
+    assert pool._mp_context.get_start_method() == 'spawn'
+    canteen.hash_passwords(['p1', 'p2'])
+    assert canteen._process_pools[(os.getpid(), 'import')] is pool
@@ -0,0 +1,47 @@
+from datetime import date
+
+import pytest
+
+import app as canteen
+from conftest import connect
+
+
+def stock(db):
+    return {row['product_name']: row['quantity'] for row in db.execute('SELECT * FROM inventory_stock')}
+
+
+def test_first_movement_of_the_day_takes_a_snapshot(database):
+    db = connect(database)
+    # Журнал с движением за прошлый день, после которого снимков ещё не было.
+    db.execute("UPDATE inventory_snapshot_runs SET taken_at = '2020-01-01 08:00:00'")
+    db.execute("INSERT INTO inventory_movements (product_name, delta, kind) VALUES ('Сахар', -1, 'consume')")
+    db.execute("UPDATE inventory_snapshot_runs SET taken_at = '2020-01-01 08:00:00'")
+    db.commit()
+    before = stock(db)
+
+    canteen.record_movements(db, 'consume', 'test', [('Сахар', -2), ('Молоко', -1)])
+    canteen.record_movements(db, 'consume', 'test', [('Сахар', -3)])
+    db.commit()
+
+    runs = db.execute('SELECT id, last_movement_id FROM inventory_snapshot_runs ORDER BY id').fetchall()
+    assert len(runs) == 3
+    assert runs[-1]['last_movement_id'] == 1
+    snapshot = dict(db.execute('SELECT product_name, quantity FROM inventory_snapshots WHERE run_id = ?',
+                               (runs[-1]['id'],)).fetchall())
+    assert snapshot['Сахар'] == pytest.approx(before['Сахар'])
+    after = stock(db)
+    assert after['Сахар'] == pytest.approx(before['Сахар'] - 5)
+    assert after['Молоко'] == pytest.approx(before['Молоко'] - 1)
+    assert {row['product_name']: row['quantity'] for row in canteen.stock_on(db, date.today())} == \
+        pytest.approx(after)
+
+
+def test_inventory_page_without_snapshot_for_the_date(database):
+    client = canteen.app.test_client()
+    client.post('/login', data={'full_name': 'Сидоров Сидор Сидорович', 'password': 'cook'})
+
+    page = client.get('/cook/inventory?on=2020-01-01').get_data(as_text=True)
+
+    assert 'Нет снимка остатков на эту дату' in page
+    assert 'Остатки на 2020-01-01' in page
+    assert '<td>Сахар</td>' not in page
@@ -0,0 +1,48 @@
+import threading
+import time
+
+import app as canteen
+from conftest import connect
+
+
+def slow(func):
+    def wrapper(db):
+        time.sleep(0.02)
+        return func(db)
+    return wrapper
+
+
+def test_concurrent_migrations_apply_each_step_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'canteen.db')
+    monkeypatch.setattr(canteen, 'DATABASE', path)
+    with monkeypatch.context() as patch:
+        patch.setattr(canteen, 'migrate_db', lambda db: [])
+        canteen.init_db()
+    # Медленные шаги, чтобы оба соединения гарантированно увидели одну и ту же версию до начала миграции.
+    monkeypatch.setattr(canteen, 'MIGRATIONS', [(version, description, slow(func))
+                                                for version, description, func in canteen.MIGRATIONS])
+    connections = [canteen.ConnectionPool(path, 1).connect() for _ in range(2)]
+    barrier = threading.Barrier(len(connections))
+    applied, errors = [], []
+
+    def migrate(db):
+        barrier.wait()
+        try:
+            applied.append(canteen.migrate_db(db))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=migrate, args=(db,)) for db in connections]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for db in connections:
+        db.close()
+    canteen.close_outboxes(path)
+    canteen.close_pools(path)
+
+    versions = [version for version, _, _ in canteen.MIGRATIONS]
+    assert errors == []
+    assert sorted(applied[0] + applied[1]) == versions
+    assert [row[0] for row in connect(path).execute('SELECT version FROM schema_version ORDER BY version')] == versions
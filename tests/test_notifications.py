@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+
+import app as canteen
+from conftest import connect
+
+
+def stage(path, messages, commit=True):
+    db = connect(path)
+    db.execute('BEGIN IMMEDIATE')
+    canteen.stage_notifications(db, messages)
+    if commit:
+        db.commit()
+    else:
+        db.rollback()
+    db.close()
+
+
+def delivered(path):
+    return [tuple(row) for row in connect(path).execute('SELECT user_id, message FROM notifications ORDER BY id')]
+
+
+def test_staged_notifications_are_delivered_after_commit(database):
+    stage(database, [(1, 'Первое'), (2, 'Второе')])
+
+    assert canteen.get_outbox().flush()
+    assert delivered(database) == [(1, 'Первое'), (2, 'Второе')]
+    db = connect(database)
+    assert db.execute('SELECT COUNT(*) FROM notification_outbox').fetchone()[0] == 0
+    assert db.execute('SELECT unread_notifications FROM users WHERE id = 1').fetchone()[0] == 1
+
+
+def test_rolled_back_notifications_are_not_delivered(database):
+    stage(database, [(1, 'Отменено')], commit=False)
+
+    assert canteen.get_outbox().flush()
+    assert delivered(database) == []
+
+
+def test_outbox_survives_without_delivery_thread(database):
+    db = connect(database)
+    db.execute('BEGIN IMMEDIATE')
+    db.execute("INSERT INTO notification_outbox (user_id, message) VALUES (1, 'После перезапуска')")
+    db.commit()
+
+    outbox = canteen.NotificationOutbox(database)
+    outbox.wake()
+    assert outbox.flush()
+    outbox.stop()
+    assert not outbox.thread.is_alive()
+    assert delivered(database) == [(1, 'После перезапуска')]
+
+
+def test_failing_notification_does_not_block_the_rest(database, monkeypatch):
+    monkeypatch.setattr(canteen, 'OUTBOX_RETRY_DELAY', 0)
+    db = connect(database)
+    db.execute('''
+        CREATE TRIGGER reject_notification BEFORE INSERT ON notifications
+        WHEN NEW.message = 'Сломанное'
+        BEGIN SELECT RAISE(ABORT, 'сломано'); END
+    ''')
+    db.commit()
+
+    stage(database, [(1, 'До'), (1, 'Сломанное'), (1, 'После')])
+
+    assert canteen.get_outbox().flush()
+    assert delivered(database) == [(1, 'До'), (1, 'После')]
+    assert [tuple(row) for row in db.execute('SELECT message, attempts FROM notification_outbox')] == \
+        [('Сломанное', canteen.OUTBOX_MAX_ATTEMPTS)]
+
+
+def test_empty_outbox_is_polled_without_write_lock(database):
+    outbox = canteen.NotificationOutbox(database)
+    writer = connect(database)
+    writer.execute('BEGIN IMMEDIATE')
+    db = connect(database)
+    db.execute('PRAGMA busy_timeout = 0')
+
+    assert outbox.deliver(db, canteen.OUTBOX_BATCH_SIZE) == 0
+
+    writer.execute("INSERT INTO notification_outbox (user_id, message) VALUES (1, 'Ждёт')")
+    writer.commit()
+    writer.execute('BEGIN IMMEDIATE')
+    with pytest.raises(sqlite3.OperationalError) as error:
+        outbox.deliver(db, canteen.OUTBOX_BATCH_SIZE)
+    assert canteen.is_busy_error(error.value)
+    writer.rollback()
+
+
+class BusyOutbox(canteen.NotificationOutbox):
+    busy = 2 * canteen.OUTBOX_MAX_ATTEMPTS
+
+    def deliver(self, db, limit):
+        if self.busy:
+            self.busy -= 1
+            raise sqlite3.OperationalError('database is locked')
+        return super().deliver(db, limit)
+
+
+def test_busy_database_does_not_use_up_attempts(database, monkeypatch):
+    monkeypatch.setattr(canteen, 'OUTBOX_BATCH_SIZE', 1)
+    monkeypatch.setattr(canteen, 'OUTBOX_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(canteen, 'OUTBOX_RETRY_DELAY_MAX', 0.01)
+    stage(database, [(1, 'Дождётся')])
+
+    outbox = BusyOutbox(database)
+    outbox.wake()
+    assert outbox.flush()
+    outbox.stop()
+
+    assert outbox.busy == 0
+    assert delivered(database) == [(1, 'Дождётся')]
+
+
+def test_requeue_returns_failed_notifications(database):
+    db = connect(database)
+    db.execute('INSERT INTO notification_outbox (user_id, message, attempts) VALUES (1, ?, ?)',
+               ('Застряло', canteen.OUTBOX_MAX_ATTEMPTS))
+    db.commit()
+
+    result = canteen.app.test_cli_runner().invoke(args=['requeue-notifications'])
+
+    assert 'Возвращено в очередь уведомлений: 1' in result.output
+    assert canteen.get_outbox().flush()
+    assert delivered(database) == [(1, 'Застряло')]
@@ -0,0 +1,45 @@
+import app as canteen
+from conftest import add_students, connect
+
+SOURCE_ALIASES = {'meal': 'mr', 'payment': 'p', 'purchase': 'pr', 'subscription': 's'}
+
+
+def add_meal_records(path, student_id, count, taken_at):
+    db = connect(path)
+    menu_id = db.execute('SELECT id FROM menu_sets LIMIT 1').fetchone()[0]
+    db.executemany("INSERT INTO meal_records (student_id, menu_id, meal_type, taken_at) VALUES (?, ?, 'lunch', ?)",
+                   [(student_id, menu_id, taken_at)] * count)
+    db.commit()
+    db.close()
+
+
+def test_pages_walk_every_operation_once(database):
+    student_id, = add_students(database, 1, 0)
+    add_meal_records(database, student_id, 70, '2026-01-01 12:00:00')
+    add_meal_records(database, student_id, 70, '2026-01-02 12:00:00')
+    db = connect(database)
+
+    seen = []
+    before = None
+    while True:
+        operations, cursor = canteen.fetch_operations(db, {'meal'}, before=before, limit=25)
+        seen.extend(operation['date'] for operation in operations)
+        if not cursor:
+            break
+        before = canteen.parse_operations_cursor(cursor)
+
+    assert len(seen) == 140
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_deep_pages_search_indexes(database):
+    db = connect(database)
+    for cursor_kind in SOURCE_ALIASES:
+        sql, params = canteen.operations_query(set(SOURCE_ALIASES),
+                                               before=('2026-01-01 12:00:00', cursor_kind, 1000))
+        plan = [row['detail'] for row in db.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        for alias in SOURCE_ALIASES.values():
+            assert any(line.startswith(f'SEARCH {alias} USING') for line in plan), (cursor_kind, plan)
+            assert not any(line.startswith(f'SCAN {alias}') for line in plan), (cursor_kind, plan)
+        # Сортируется только объединение из нескольких страниц, а не сами таблицы.
+        assert plan.count('USE TEMP B-TREE FOR ORDER BY') == 1, (cursor_kind, plan)
@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+
+import pytest
+
+import app as canteen
+from conftest import add_students, connect
+
+
+def record_meals(db, day, meal_type, count):
+    db.executemany("INSERT INTO meal_records (student_id, menu_id, meal_type, taken_at) VALUES (3, 1, ?, ?)",
+                   [(meal_type, f'{day} 09:00:00')] * count)
+
+
+def test_expected_portions_average_days_with_meals(database):
+    db = connect(database)
+    today = date.today()
+    record_meals(db, today - timedelta(days=1), 'breakfast', 3)
+    record_meals(db, today - timedelta(days=2), 'breakfast', 1)
+    record_meals(db, today - timedelta(days=2), 'lunch', 4)
+    record_meals(db, today - timedelta(days=canteen.PLANNER_ATTENDANCE_DAYS + 1), 'lunch', 40)
+    # Прогноз читает только сводку daily_stats, сырые записи о питании ему не нужны.
+    db.execute('DELETE FROM meal_records')
+    db.commit()
+
+    assert canteen.expected_portions(db, today) == {'breakfast': 2, 'lunch': 4}
+
+
+def test_expected_portions_without_history_counts_students(database):
+    add_students(database, 9, 0)
+
+    assert canteen.expected_portions(connect(database), date.today()) == {'breakfast': 10, 'lunch': 10}
+
+
+def test_plan_demand_converts_to_stock_units(database):
+    add_students(database, 99, 0)
+    db = connect(database)
+    db.execute("UPDATE inventory SET unit = 'г', quantity = 8000 WHERE product_name = 'Фарш'")
+    db.execute("UPDATE inventory SET unit = 'шт' WHERE product_name = 'Сахар'")
+    db.commit()
+    start = date.today()
+
+    plan = canteen.plan_demand(db, start, 2)
+
+    rows = {row['ingredient']: row for row in plan['rows']}
+    assert plan['menu_days'] == 2
+    assert rows['Овсянка']['demand'] == pytest.approx(20)
+    assert rows['Овсянка']['shortfall'] == pytest.approx(10)
+    assert rows['Овсянка']['runs_out'] == start + timedelta(days=1)
+    assert rows['Фарш']['unit'] == 'г'
+    assert rows['Фарш']['demand'] == pytest.approx(30000)
+    assert rows['Фарш']['shortfall'] == pytest.approx(22000)
+    assert not rows['Сахар']['comparable']
+    assert rows['Сахар']['shortfall'] == 0
+
+    canteen.create_purchase_request(db, 2, 'Сидоров Сидор Сидорович',
+                                    [(row['ingredient'], str(row['shortfall']), row['unit'])
+                                     for row in plan['rows'] if row['shortfall'] > 0])
+    item = db.execute("SELECT quantity, unit FROM purchase_request_items WHERE product_name = 'Фарш'").fetchone()
+    assert tuple(item) == (22000, 'г')
+
+
+def test_planner_warns_about_units_it_cannot_convert(database):
+    db = connect(database)
+    db.execute("UPDATE inventory SET unit = 'шт' WHERE product_name = 'Сахар'")
+    db.commit()
+    client = canteen.app.test_client()
+    client.post('/login', data={'full_name': 'Сидоров Сидор Сидорович', 'password': 'cook'})
+
+    page = client.get('/cook/planner?days=30').get_data(as_text=True)
+
+    assert 'Сахар (кг / шт)' in page
+    assert 'name="product" value="Сахар"' not in page
@@ -0,0 +1,31 @@
+import app as canteen
+from conftest import connect, set_stock
+
+
+def capacity(path):
+    db = connect(path)
+    stock = dict(db.execute('SELECT product_name, quantity FROM inventory_stock').fetchall())
+    return canteen.cookable_portions(canteen.get_catalog(db), stock)
+
+
+def test_cookable_portions_follow_the_scarcest_ingredient(database):
+    set_stock(database, 'Фарш', 0.45)
+    set_stock(database, 'Картофель', 30)
+
+    result = capacity(database)
+
+    assert result['Котлета с картошкой'] == {'portions': 3, 'limiting': 'Фарш'}
+    assert result['Борщ'] == {'portions': 50, 'limiting': 'Свекла'}
+
+
+def test_dish_is_unavailable_when_an_ingredient_runs_out(database):
+    set_stock(database, 'Сухофрукты', 0)
+
+    result = capacity(database)
+
+    assert result['Компот'] == {'portions': 0, 'limiting': 'Сухофрукты'}
+    client = canteen.app.test_client()
+    client.post('/login', data={'full_name': 'Сидоров Сидор Сидорович', 'password': 'cook'})
+    page = client.get('/cook/prepare?search=Компот').get_data(as_text=True)
+    assert 'Можно приготовить ещё: <strong>0</strong> порц.' in page
+    assert 'name="dish" value="Компот"' not in page
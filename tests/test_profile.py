@@ -0,0 +1,38 @@
+import app as canteen
+from conftest import connect
+
+
+def login_student():
+    client = canteen.app.test_client()
+    client.post('/login', data={'full_name': 'Шнец Владимир Владимирович', 'password': 'student'})
+    return client
+
+
+def catalog_version(path):
+    return connect(path).execute('SELECT version FROM catalog_version').fetchone()[0]
+
+
+def test_masks_flag_dishes_with_declared_allergen(database):
+    db = connect(database)
+    allergy_mask, preference_mask = canteen.update_student_masks(db, 3, 'Молоко, кошки', 'свекла')
+    db.commit()
+    catalog = canteen.get_catalog(db)
+    menu = catalog.menu_for(canteen.date.today())
+
+    allergens, preferred = catalog.menu_flags([menu], allergy_mask, preference_mask)
+
+    assert set(allergens) == {'Овсяная каша', 'Какао'}
+    assert set(preferred) == {'Борщ'}
+    assert catalog.mask_names(allergy_mask, db) == ['молоко', 'кошки']
+
+
+def test_profile_save_keeps_catalog_version(database):
+    before = catalog_version(database)
+    client = login_student()
+
+    client.post('/student/profile', data={'allergies': 'кошки, молоко', 'preferences': 'пыльца'})
+
+    assert catalog_version(database) == before
+    page = client.get('/student/menu').get_data(as_text=True)
+    assert 'У вас есть аллергия на: <em>молоко, кошки</em>' in page
+    assert page.count('⚠️</span>') == 2
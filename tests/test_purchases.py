@@ -0,0 +1,27 @@
+import pytest
+
+import app as canteen
+from conftest import connect
+
+
+@pytest.mark.parametrize('quantity', ['inf', '-inf', 'nan', 'Infinity', 'abc', '0', '-1'])
+def test_purchase_request_rejects_bad_quantities(database, quantity):
+    db = connect(database)
+
+    with pytest.raises(canteen.PurchaseRequestError):
+        canteen.create_purchase_request(db, 2, 'Сидоров Сидор Сидорович', [('Сахар', quantity, '')])
+
+    assert db.execute('SELECT COUNT(*) FROM purchase_requests').fetchone()[0] == 0
+
+
+def test_purchase_request_is_received_on_approval(database):
+    db = connect(database)
+    before = db.execute("SELECT quantity FROM inventory_stock WHERE product_name = 'Сахар'").fetchone()[0]
+
+    request_id = canteen.create_purchase_request(db, 2, 'Сидоров Сидор Сидорович',
+                                                 [('Сахар', '2,5', ''), ('Ананас', '3', 'шт')])
+    canteen.approve_purchase_requests(db, 1, [request_id])
+
+    stock = dict(db.execute('SELECT product_name, quantity FROM inventory_stock').fetchall())
+    assert stock['Сахар'] == pytest.approx(before + 2.5)
+    assert stock['Ананас'] == pytest.approx(3)
@@ -0,0 +1,37 @@
+import pytest
+
+import app as canteen
+from conftest import connect
+
+
+@pytest.fixture
+def checked_database(database, monkeypatch):
+    db = connect(database)
+    canteen.generate_school_data(db, students=1200, days=14, dishes=8, notifications=3, seed=1)
+    db.close()
+    monkeypatch.setattr(canteen, 'QUERY_CHECK', 'raise')
+    monkeypatch.setattr(canteen, '_statement_hooks', [canteen.collect_query])
+    monkeypatch.setattr(canteen.app, 'testing', True)
+    # Соединения из init_db() открыты без trace callback.
+    canteen.close_pools(database)
+    return database
+
+
+def test_routes_have_no_n_plus_one_or_full_scans(checked_database):
+    clients = {}
+    for role, (full_name, password) in canteen.BENCH_USERS.items():
+        clients[role] = canteen.app.test_client()
+        clients[role].post('/login', data={'full_name': full_name, 'password': password})
+    anonymous = canteen.app.test_client()
+
+    problems = []
+    for role, method, path, data in canteen.BENCH_CASES:
+        client = clients[role] if role else anonymous
+        try:
+            response = client.open(path, method=method, data=data)
+        except canteen.QueryCheckError as e:
+            problems.append(str(e))
+            continue
+        assert response.status_code < 500, (method, path)
+
+    assert problems == []
@@ -0,0 +1,51 @@
+import pytest
+
+import app as canteen
+from conftest import add_students, connect
+
+
+def test_failed_chunk_keeps_results_of_committed_chunks(database, monkeypatch):
+    monkeypatch.setattr(canteen, 'SERVING_BATCH_SIZE', 2)
+    students = add_students(database, 6, 1000)
+    broken = students[3]
+    db = connect(database)
+    db.execute(f'''
+        CREATE TRIGGER reject_meal BEFORE INSERT ON meal_records
+        WHEN NEW.student_id = {broken}
+        BEGIN SELECT RAISE(ABORT, 'сломано'); END
+    ''')
+    db.commit()
+
+    with canteen.app.app_context():
+        results = canteen.issue_meals(canteen.get_db(), students, 'lunch')
+    assert canteen.get_outbox().flush()
+
+    assert [result['student_id'] for result in results] == students
+    assert [result['status'] for result in results] == ['issued', 'issued', 'failed', 'failed', 'issued', 'issued']
+    issued = students[:2] + students[4:]
+    balances = dict(db.execute('SELECT user_id, balance FROM student_profiles').fetchall())
+    assert [balances[student_id] for student_id in students] == [855, 855, 1000, 1000, 855, 855]
+    assert [row[0] for row in db.execute('SELECT student_id FROM meal_records ORDER BY id')] == issued
+    notified = [row[0] for row in db.execute("SELECT user_id FROM notifications WHERE message = 'Вы получили lunch!'")]
+    assert sorted(notified) == issued
+    assert db.execute("SELECT message FROM notifications WHERE user_id = 2").fetchone()[0] == \
+        'На раздаче выдано lunch: 4. Списано: 580.0 ₽.'
+
+
+def test_programming_error_in_a_chunk_propagates(database, monkeypatch):
+    monkeypatch.setattr(canteen, 'SERVING_BATCH_SIZE', 2)
+    students = add_students(database, 4, 1000)
+    calls = []
+
+    def stage_notifications(db, messages):
+        calls.append(messages)
+        if len(calls) == 2:
+            raise TypeError('ошибка в коде')
+
+    monkeypatch.setattr(canteen, 'stage_notifications', stage_notifications)
+
+    with canteen.app.app_context(), pytest.raises(TypeError):
+        canteen.issue_meals(canteen.get_db(), students, 'lunch')
+
+    balances = dict(connect(database).execute('SELECT user_id, balance FROM student_profiles').fetchall())
+    assert [balances[student_id] for student_id in students] == [855, 855, 1000, 1000]